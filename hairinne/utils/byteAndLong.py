@@ -13,7 +13,6 @@ def toBytearray(
 ) -> bytearray:
     res = bytearray()
     for i in range(range_):
-        print(a)
         res.append((a >> (i * 8)) & 0xFF)
     return res if endian is Endian.LITTLE_ENDIAN else res[::-1]
 
@@ -4,6 +4,7 @@ from ldk.l.util.option import (
     OptionsParser, Options
 )
 
+from ldk.l.lvm.module import Module
 from ldk.l.lvm.vm import (
     VirtualMachine
 )
@@ -18,12 +19,55 @@ def getOptionsParser() -> OptionsParser:
             .add(["--version", "-v"], "version", bool, False)
             .add(["--verbose", "-verbose"], "verbose", bool, False)
             .add(["--stackSize", "--s"], "stackSize", int, DEFAULT_STACK_SIZE)
+            .add(["--dispatch"], "dispatch", str, VirtualMachine.DISPATCH_MATCH,
+                 "Instruction dispatch: " + " | ".join(VirtualMachine.DISPATCH_MODES))
+            .add(["--fusion"], "fusion", bool, True, "Fuse common instruction sequences at load time")
+            .add(["--aotCacheDir"], "aotCacheDir", str, "", "Cache directory for --dispatch=aot translations")
+            .add(["--jit"], "jit", bool, False, "Compile hot loops into traces (uses table dispatch)")
+            .add(["--jitThreshold"], "jitThreshold", int, 50, "Backward branches before a loop is traced")
+            .add(["--tlbSize"], "tlbSize", int, 64, "Entries in each thread's TLB (power of two)")
+            .add(["--heapPageSize"], "heapPageSize", int, 4096,
+                 "Page size for large heap blocks and regions (power of two, e.g. 2097152)")
+            .add(["--codeCacheDir"], "codeCacheDir", str, "", "Cache directory for predecoded text segments")
+            .add(["--codeCacheSize"], "codeCacheSize", int, 64 * 1024 * 1024,
+                 "Maximum total bytes kept in --codeCacheDir")
             )
 
 
 def main(args: list[str]) -> void:
-    options = getOptionsParser().parse(args)
-    virtual_machine = VirtualMachine()
+    options = getOptionsParser().parse(args[1:])
+    virtual_machine = VirtualMachine(
+        options.get("stackSize", int),
+        options.get("dispatch", str),
+        options.get("fusion", bool),
+        options.get("aotCacheDir", str),
+        options.get("jit", bool),
+        options.get("jitThreshold", int),
+        options.get("tlbSize", int),
+        options.get("heapPageSize", int),
+        options.get("codeCacheDir", str),
+        options.get("codeCacheSize", int)
+    )
+    if options.args:
+        module = Module.load(options.args[0])
+        virtual_machine.init(module)
+        if options.get("verbose", bool):
+            for name, count in virtual_machine.fusion_counts.items():
+                print(f"Fused {name}: {count}")
+        result = virtual_machine.run()
+        if options.get("verbose", bool):
+            for name, count in virtual_machine.tlb_stats.items():
+                print(f"TLB {name}: {count}")
+            if virtual_machine.jit is not None:
+                for name, count in virtual_machine.jit.stats.items():
+                    print(f"JIT {name}: {count}")
+            print(f"Module pages decompressed: {module.decompressedPages()}")
+            for name, count in virtual_machine.memory.page_store.stats.items():
+                print(f"Shared pages {name}: {count}")
+            if virtual_machine.code_cache is not None:
+                for name, count in virtual_machine.code_cache.stats.items():
+                    print(f"Code cache {name}: {count}")
+        sys.exit(result)
 
 
 if __name__ == '__main__':
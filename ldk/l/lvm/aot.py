@@ -0,0 +1,506 @@
+import hashlib
+import importlib.util
+import os
+import sys
+import threading
+import types
+from typing import Optional
+
+from ldk.l.lvm.module import Module
+from ldk.l.lvm.vm import ByteCode, VirtualMachine
+
+AOT_VERSION = 1
+
+_PC = ByteCode.PC_REGISTER
+_SP = ByteCode.SP_REGISTER
+_BP = ByteCode.BP_REGISTER
+
+_ACCESSORS = {1: "byte", 2: "short", 4: "int", 8: "long"}
+
+
+def _build_signatures() -> dict[int, tuple[str, str]]:
+    """
+      每条指令的 (操作数签名, 隐式寄存器签名)
+
+      操作数签名每个字符对应一个操作数: r=读寄存器, w=写寄存器, x=读写寄存器, i=立即数
+      隐式寄存器签名中 s/S 表示读/读写SP, b/B 表示读/读写BP
+    """
+    signatures = {
+        ByteCode.NOP: ("", ""),
+        ByteCode.CMP: ("irr", ""),
+        ByteCode.ATOMIC_CMP: ("irr", ""),
+        ByteCode.MOV: ("rw", ""),
+        ByteCode.JUMP: ("r", ""),
+        ByteCode.JUMP_IMMEDIATE: ("i", ""),
+        ByteCode.MALLOC: ("rw", ""),
+        ByteCode.FREE: ("r", ""),
+        ByteCode.REALLOC: ("rrw", ""),
+        ByteCode.CAS: ("rxr", ""),
+        ByteCode.INVOKE: ("r", "S"),
+        ByteCode.INVOKE_IMMEDIATE: ("i", "S"),
+        ByteCode.RETURN: ("", "S"),
+        ByteCode.GET_RESULT: ("w", ""),
+        ByteCode.SET_RESULT: ("r", ""),
+        ByteCode.TYPE_CAST: ("irw", ""),
+        ByteCode.OPEN: ("rrrw", ""),
+        ByteCode.CLOSE: ("rw", ""),
+        ByteCode.READ: ("rrrw", ""),
+        ByteCode.WRITE: ("rrrw", ""),
+        ByteCode.CREATE_FRAME: ("i", "SB"),
+        ByteCode.DESTROY_FRAME: ("i", "SB"),
+        ByteCode.EXIT: ("r", ""),
+        ByteCode.EXIT_IMMEDIATE: ("i", ""),
+        ByteCode.GET_FIELD_ADDRESS: ("riw", ""),
+        ByteCode.GET_LOCAL_ADDRESS: ("iw", "b"),
+        ByteCode.GET_PARAMETER_ADDRESS: ("iw", "b"),
+        ByteCode.CREATE_THREAD: ("iw", ""),
+        ByteCode.THREAD_CONTROL: ("riix", ""),
+        ByteCode.MEMCPY: ("rrr", ""),
+        ByteCode.MEMSET: ("rrr", ""),
+        ByteCode.MEMCMP: ("rrrw", ""),
+        ByteCode.STRLEN: ("rw", ""),
+        ByteCode.REGION_CREATE: ("w", ""),
+        ByteCode.REGION_ALLOC: ("rrw", ""),
+        ByteCode.REGION_DESTROY: ("r", "")
+    }
+    for size in range(4):
+        signatures[ByteCode.PUSH_1 + size] = ("r", "S")
+        signatures[ByteCode.POP_1 + size] = ("w", "S")
+        signatures[ByteCode.LOAD_1 + size] = ("rw", "")
+        signatures[ByteCode.STORE_1 + size] = ("rr", "")
+        signatures[ByteCode.MOV_IMMEDIATE1 + size] = ("iw", "")
+    for code in range(ByteCode.MOV_E, ByteCode.MOV_UGE + 1):
+        signatures[code] = ("rw", "")
+    for code in range(ByteCode.JE, ByteCode.JUGE + 1):
+        signatures[code] = ("r", "")
+    for code in range(ByteCode.ADD, ByteCode.MOD_FLOAT + 1):
+        signatures[code] = ("rrw", "")
+    for code in (ByteCode.NOT, ByteCode.NEG):
+        signatures[code] = ("rw", "")
+    for code in (ByteCode.INC, ByteCode.DEC):
+        signatures[code] = ("x", "")
+    for code in range(ByteCode.LONG_TO_DOUBLE, ByteCode.FLOAT_TO_DOUBLE + 1):
+        signatures[code] = ("rw", "")
+    # 原子运算的第一个操作数是地址寄存器, 其余与对应的普通运算一致
+    for code in range(ByteCode.ATOMIC_ADD, ByteCode.ATOMIC_MOD_FLOAT + 1):
+        operand_signature = signatures[code - ByteCode.ATOMIC_ADD + ByteCode.ADD][0]
+        signatures[code] = ("r" + operand_signature[1:].replace("x", "r"), "")
+    return signatures
+
+
+SIGNATURES = _build_signatures()
+
+
+def register_effects(code: int, operands: tuple[int, ...]) -> tuple[set[int], set[int]]:
+    """返回指令读取和写入的寄存器集合"""
+    operand_signature, implicit_signature = SIGNATURES.get(code, ("", ""))
+    reads, writes = set(), set()
+    for kind, operand in zip(operand_signature, operands):
+        if kind in "rx":
+            reads.add(operand)
+        if kind in "wx":
+            writes.add(operand)
+    for kind in implicit_signature:
+        register = _SP if kind in "sS" else _BP
+        reads.add(register)
+        if kind.isupper():
+            writes.add(register)
+    return reads, writes
+
+
+def decode_text(text: bytes) -> dict[int, tuple[int, tuple[int, ...], int]]:
+    """线性扫描text段, 返回 pc -> (opcode, operands, next_pc)"""
+    instructions = {}
+    pc = 0
+    while pc < len(text):
+        code = text[pc]
+        address = pc + 1
+        operands = []
+        for width in ByteCode.instruction_operands.get(code, ()):
+            operands.append(int.from_bytes(text[address:address + width], "little"))
+            address += width
+        if address > len(text):
+            break
+        instructions[pc] = (code, tuple(operands), address)
+        pc = address
+    return instructions
+
+
+def _is_control(code: int) -> bool:
+    return ByteCode.is_jump(code) or code in (ByteCode.INVOKE, ByteCode.INVOKE_IMMEDIATE, ByteCode.RETURN)
+
+
+def is_terminator(code: int, operands: tuple[int, ...]) -> bool:
+    """会结束基本块的指令: 跳转、调用、返回、退出以及写PC的指令"""
+    if _is_control(code) or code in (ByteCode.EXIT, ByteCode.EXIT_IMMEDIATE):
+        return True
+    return _PC in register_effects(code, operands)[1]
+
+
+def static_target(code: int, operands: tuple[int, ...], constants: dict[int, int]) -> int | None:
+    """静态可确定的跳转/调用目标, 无法确定时返回None"""
+    if code in (ByteCode.JUMP_IMMEDIATE, ByteCode.INVOKE_IMMEDIATE):
+        return operands[0]
+    if code in (ByteCode.JUMP, ByteCode.INVOKE) or ByteCode.is_conditional_jump(code):
+        return constants.get(operands[0])
+    return None
+
+
+def track_constants(code: int, operands: tuple[int, ...], constants: dict[int, int]):
+    """根据指令更新寄存器常量表"""
+    writes = register_effects(code, operands)[1]
+    for register in writes:
+        constants.pop(register, None)
+    if ByteCode.MOV_IMMEDIATE1 <= code <= ByteCode.MOV_IMMEDIATE8:
+        constants[operands[1]] = operands[0]
+    elif code == ByteCode.MOV and operands[0] in constants:
+        constants[operands[1]] = constants[operands[0]]
+
+
+def find_leaders(instructions: dict[int, tuple[int, tuple[int, ...], int]], entrypoint: int) -> list[int]:
+    """找出所有基本块的起始地址, 迭代直到静态可解析的跳转目标不再增加"""
+    leaders = {pc for pc in (0, entrypoint) if pc in instructions}
+    # 立即数加载的值若恰好是指令地址, 可能在其它块中被用作间接跳转目标
+    for code, operands, _ in instructions.values():
+        if ByteCode.MOV_IMMEDIATE1 <= code <= ByteCode.MOV_IMMEDIATE8 and operands[0] in instructions:
+            leaders.add(operands[0])
+    while True:
+        found = set(leaders)
+        constants: dict[int, int] = {}
+        for pc, (code, operands, next_pc) in instructions.items():
+            if pc in leaders:
+                constants = {}
+            if is_terminator(code, operands):
+                target = static_target(code, operands, constants)
+                if target in instructions:
+                    found.add(target)
+                if next_pc in instructions:
+                    found.add(next_pc)
+                constants = {}
+            else:
+                track_constants(code, operands, constants)
+        if found == leaders:
+            return sorted(leaders)
+        leaders = found
+
+
+class AOTCompiler:
+    """把Module的text段翻译为每个基本块一个函数的Python源码"""
+
+    def __init__(self, module: Module, decoded: Optional[tuple[dict, list[int]]] = None):
+        """decoded: 已有的 (指令表, 基本块起始地址), 如来自CodeCache"""
+        self.module = module
+        self.text = bytes(module.text)
+        self.text_hash = hashlib.sha256(self.text).hexdigest()
+        if decoded is None:
+            self.instructions = decode_text(self.text)
+            self.leaders = find_leaders(self.instructions, module.entrypoint)
+        else:
+            self.instructions, self.leaders = decoded
+
+    def blocks(self) -> dict[int, list[int]]:
+        """返回 起始地址 -> 块内指令地址列表"""
+        leaders = set(self.leaders)
+        blocks: dict[int, list[int]] = {}
+        for start in self.leaders:
+            pcs = []
+            pc = start
+            while pc in self.instructions:
+                pcs.append(pc)
+                code, operands, next_pc = self.instructions[pc]
+                if is_terminator(code, operands) or next_pc in leaders:
+                    break
+                pc = next_pc
+            blocks[start] = pcs
+        return blocks
+
+    def translate(self) -> str:
+        lines = [
+            f"# Generated by ldk.l.lvm.aot, do not edit",
+            f"from ldk.l.lvm.vm import DISPATCH_TABLE as H, _CONDITIONS, _divide, _modulo",
+            f"",
+            f"AOT_VERSION = {AOT_VERSION}",
+            f"LVM_VERSION = {VirtualMachine.LVM_VERSION}",
+            f"TEXT_HASH = {self.text_hash!r}",
+            f"MASK64 = 0xFFFFFFFFFFFFFFFF",
+        ]
+        lines.extend(f"C{i} = _CONDITIONS[{i}]" for i in range(ByteCode.JUGE - ByteCode.JE + 1))
+
+        blocks = self.blocks()
+        for start, pcs in blocks.items():
+            lines.append("")
+            lines.append("")
+            lines.extend(self._emit_block(start, pcs))
+
+        lines.append("")
+        lines.append("")
+        lines.append("BLOCKS = {")
+        lines.extend(f"    {start}: block_{start:x}," for start in blocks)
+        lines.append("}")
+        lines.append("")
+        return "\n".join(lines)
+
+    def _emit_block(self, start: int, pcs: list[int]) -> list[str]:
+        used, written = set(), set()
+        uses_flags = False
+        for pc in pcs:
+            code, operands, _ = self.instructions[pc]
+            reads, writes = register_effects(code, operands)
+            used |= reads | writes
+            written |= writes
+            uses_flags |= accesses_flags(code)
+        used.discard(_PC)
+        written.discard(_PC)
+
+        body = [f"def block_{start:x}(eu, r, m):"]
+        body.extend(f"    r{register} = r[{register}]" for register in sorted(used))
+        if uses_flags:
+            body.append("    flags = eu.flags")
+
+        flush = [f"r[{register}] = r{register}" for register in sorted(written)]
+        if uses_flags:
+            flush.append("eu.flags = flags")
+        reload = [f"r{register} = r[{register}]" for register in sorted(used)]
+        if uses_flags:
+            reload.append("flags = eu.flags")
+
+        constants: dict[int, int] = {}
+        next_pc = start
+        for pc in pcs:
+            code, operands, next_pc = self.instructions[pc]
+            body.extend("    " + line for line in
+                        self._emit_instruction(code, operands, next_pc, constants, flush, reload))
+            track_constants(code, operands, constants)
+
+        code, operands, _ = self.instructions[pcs[-1]]
+        if not is_terminator(code, operands):
+            body.extend("    " + line for line in flush)
+            body.append(f"    return {next_pc}")
+        return body
+
+    def _emit_instruction(self, code: int, operands: tuple[int, ...], next_pc: int,
+                          constants: dict[int, int], flush: list[str], reload: list[str]) -> list[str]:
+        writes = register_effects(code, operands)[1]
+        names = operand_names(code, operands, next_pc)
+
+        lines = [f"# {ByteCode.instruction_names.get(code, code)} {operands}"]
+        if _PC in writes:
+            lines.append(f"r{_PC} = {next_pc}")
+
+        if _is_control(code):
+            return lines + self._emit_control(code, operands, names, next_pc, constants, flush)
+
+        if code in _INLINE:
+            lines.extend(_INLINE[code](operands, names))
+        else:
+            lines.extend(emit_fallback(code, operands, next_pc, flush, reload))
+
+        if _PC in writes:
+            lines.extend(flush)
+            lines.append(f"return r{_PC}")
+        return lines
+
+    @staticmethod
+    def _emit_control(code: int, operands: tuple[int, ...], names: list[str], next_pc: int,
+                      constants: dict[int, int], flush: list[str]) -> list[str]:
+        target = static_target(code, operands, constants)
+        target = str(target) if target is not None else (names[0] if names else None)
+        lines = []
+        if ByteCode.is_conditional_jump(code):
+            lines.append(f"if C{code - ByteCode.JE}[flags & 7]:")
+            lines.extend("    " + line for line in flush)
+            lines.append(f"    return {target}")
+            lines.extend(flush)
+            lines.append(f"return {next_pc}")
+            return lines
+        if code in (ByteCode.INVOKE, ByteCode.INVOKE_IMMEDIATE):
+            lines.append(f"r{_SP} = r{_SP} - 8")
+            lines.append(f"m.set_long(r{_SP}, {next_pc})")
+        elif code == ByteCode.RETURN:
+            lines.append(f"target = m.get_long(r{_SP})")
+            lines.append(f"r{_SP} = r{_SP} + 8")
+            target = "target"
+        lines.extend(flush)
+        lines.append(f"return {target}")
+        return lines
+
+
+def operand_names(code: int, operands: tuple[int, ...], next_pc: int) -> list[str]:
+    """生成代码中各操作数的表达式: 寄存器为局部变量名, 立即数为字面量"""
+    names = []
+    for kind, operand in zip(SIGNATURES.get(code, ("", ""))[0], operands):
+        if kind == "i":
+            names.append(str(operand))
+        elif operand == _PC and kind == "r":
+            # 执行时PC寄存器已指向下一条指令
+            names.append(str(next_pc))
+        else:
+            names.append(f"r{operand}")
+    return names
+
+
+def accesses_flags(code: int) -> bool:
+    """指令在生成代码中是否需要局部变量flags"""
+    return (code == ByteCode.CMP or ByteCode.MOV_E <= code <= ByteCode.MOV_UGE or
+            ByteCode.is_conditional_jump(code) or (code not in _INLINE and not _is_control(code)))
+
+
+def emit_inline(code: int, operands: tuple[int, ...], names: list[str]) -> list[str] | None:
+    """可内联指令的代码, 不可内联时返回None"""
+    emitter = _INLINE.get(code)
+    return emitter(operands, names) if emitter is not None else None
+
+
+def emit_fallback(code: int, operands: tuple[int, ...], next_pc: int,
+                  flush: list[str], reload: list[str]) -> list[str]:
+    """回退到解释器处理函数的代码, 调用前后同步寄存器与标志位"""
+    return [
+        *flush,
+        f"r[{_PC}] = {next_pc}",
+        f"H[{code}](eu, r, m, {operands!r})",
+        "if not eu.running:",
+        f"    return {next_pc}",
+        f"if r[{_PC}] != {next_pc}:",
+        f"    return r[{_PC}]",
+        *reload
+    ]
+
+
+def _binary(operator: str):
+    return lambda operands, names: [f"{names[2]} = {names[0]} {operator} {names[1]}"]
+
+
+def _compare(operands, names):
+    type_ = operands[0]
+    mask = {ByteCode.BYTE_TYPE: " & 0xFF", ByteCode.SHORT_TYPE: " & 0xFFFF",
+            ByteCode.INT_TYPE: " & 0xFFFFFFFF"}.get(type_, "")
+    return [
+        f"a = {names[1]}{mask}",
+        f"b = {names[2]}{mask}",
+        "flags = (flags & ~7) | (1 if a == b else (2 if a < b else 0) | (4 if (a & MASK64) < (b & MASK64) else 0))"
+    ]
+
+
+def _build_inline() -> dict:
+    inline = {
+        ByteCode.NOP: lambda operands, names: [],
+        ByteCode.CMP: _compare,
+        ByteCode.MOV: lambda operands, names: [f"{names[1]} = {names[0]}"],
+        ByteCode.ADD: _binary("+"),
+        ByteCode.SUB: _binary("-"),
+        ByteCode.MUL: _binary("*"),
+        ByteCode.AND: _binary("&"),
+        ByteCode.OR: _binary("|"),
+        ByteCode.XOR: _binary("^"),
+        ByteCode.DIV: lambda operands, names: [f"{names[2]} = _divide({names[0]}, {names[1]})"],
+        ByteCode.MOD: lambda operands, names: [f"{names[2]} = _modulo({names[0]}, {names[1]})"],
+        ByteCode.SHL: lambda operands, names: [f"{names[2]} = {names[0]} << ({names[1]} & 63)"],
+        ByteCode.SHR: lambda operands, names: [f"{names[2]} = {names[0]} >> ({names[1]} & 63)"],
+        ByteCode.USHR: lambda operands, names: [f"{names[2]} = ({names[0]} & MASK64) >> ({names[1]} & 63)"],
+        ByteCode.NOT: lambda operands, names: [f"{names[1]} = ~{names[0]}"],
+        ByteCode.NEG: lambda operands, names: [f"{names[1]} = -{names[0]}"],
+        ByteCode.INC: lambda operands, names: [f"{names[0]} = {names[0]} + 1"],
+        ByteCode.DEC: lambda operands, names: [f"{names[0]} = {names[0]} - 1"],
+        ByteCode.GET_RESULT: lambda operands, names: [f"{names[0]} = eu.result"],
+        ByteCode.SET_RESULT: lambda operands, names: [f"eu.result = {names[0]}"],
+        ByteCode.CREATE_FRAME: lambda operands, names: [
+            f"r{_SP} = r{_SP} - 8",
+            f"m.set_long(r{_SP}, r{_BP})",
+            f"r{_BP} = r{_SP}",
+            f"r{_SP} = r{_SP} - {names[0]}"
+        ],
+        ByteCode.DESTROY_FRAME: lambda operands, names: [
+            f"r{_SP} = r{_SP} + {names[0]}",
+            f"r{_BP} = m.get_long(r{_SP})",
+            f"r{_SP} = r{_SP} + 8"
+        ],
+        ByteCode.GET_FIELD_ADDRESS: lambda operands, names: [f"{names[2]} = {names[0]} + {names[1]}"],
+        ByteCode.GET_LOCAL_ADDRESS: lambda operands, names: [f"{names[1]} = r{_BP} - {names[0]}"],
+        ByteCode.GET_PARAMETER_ADDRESS: lambda operands, names: [f"{names[1]} = r{_BP} + 16 + {names[0]}"]
+    }
+    for size, accessor in _ACCESSORS.items():
+        index = size.bit_length() - 1
+        inline[ByteCode.MOV_IMMEDIATE1 + index] = lambda operands, names: [f"{names[1]} = {names[0]}"]
+        inline[ByteCode.LOAD_1 + index] = \
+            lambda operands, names, accessor=accessor: [f"{names[1]} = m.get_{accessor}({names[0]})"]
+        inline[ByteCode.STORE_1 + index] = \
+            lambda operands, names, accessor=accessor: [f"m.set_{accessor}({names[0]}, {names[1]})"]
+        inline[ByteCode.PUSH_1 + index] = lambda operands, names, size=size, accessor=accessor: [
+            f"r{_SP} = r{_SP} - {size}",
+            f"m.set_{accessor}(r{_SP}, {names[0]})"
+        ]
+        inline[ByteCode.POP_1 + index] = lambda operands, names, size=size, accessor=accessor: [
+            f"r{_SP} = r{_SP} + {size}",
+            f"{names[0]} = m.get_{accessor}(r{_SP} - {size})"
+        ]
+    for i in range(ByteCode.JUGE - ByteCode.JE + 1):
+        inline[ByteCode.MOV_E + i] = \
+            lambda operands, names, i=i: [f"if C{i}[flags & 7]:", f"    {names[1]} = {names[0]}"]
+    return inline
+
+
+_INLINE = _build_inline()
+
+
+def load_source(source: str, name: str = "lvm_aot") -> types.ModuleType:
+    """用compile()把生成的源码编译为模块对象"""
+    module = types.ModuleType(name)
+    exec(compile(source, f"<{name}>", "exec"), module.__dict__)
+    return module
+
+
+def compile_module(module: Module, cache_dir: str = "",
+                   decoded: Optional[tuple[dict, list[int]]] = None) -> types.ModuleType:
+    """
+      AOT编译Module, 返回带有BLOCKS表的模块对象
+
+      @param module: 要编译的模块
+
+      @param cache_dir: 缓存目录, 非空时生成的源码以text哈希命名保存并在下次直接导入
+
+      @param decoded: 已有的 (指令表, 基本块起始地址), 给出时不再解码text段
+    """
+    if not cache_dir:
+        return load_source(AOTCompiler(module, decoded).translate())
+
+    text_hash = hashlib.sha256(bytes(module.text)).hexdigest()
+    name = f"lvm_aot_{text_hash[:32]}"
+    path = os.path.join(cache_dir, name + ".py")
+    if os.path.exists(path):
+        spec = importlib.util.spec_from_file_location(name, path)
+        compiled = importlib.util.module_from_spec(spec)
+        try:
+            spec.loader.exec_module(compiled)
+        except Exception:
+            # 缓存文件损坏 (如写入中断), 重新翻译并覆盖
+            compiled = None
+        if (compiled is not None and getattr(compiled, "AOT_VERSION", None) == AOT_VERSION and
+                getattr(compiled, "LVM_VERSION", None) == VirtualMachine.LVM_VERSION and
+                getattr(compiled, "TEXT_HASH", None) == text_hash):
+            return compiled
+
+    source = AOTCompiler(module, decoded).translate()
+    os.makedirs(cache_dir, exist_ok=True)
+    temporary = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(temporary, "w", encoding="utf-8") as f:
+        f.write(source)
+    os.replace(temporary, path)
+    return load_source(source, name)
+
+
+def main(args: list[str]):
+    if len(args) < 2:
+        print("Usage: lvm-aot <module> [output.py]")
+        return 1
+    module = Module.load(args[1])
+    source = AOTCompiler(module).translate()
+    if len(args) > 2:
+        with open(args[2], "w", encoding="utf-8") as f:
+            f.write(source)
+    else:
+        print(source)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,138 @@
+import hashlib
+import mmap
+import os
+import struct
+import threading
+from typing import Optional
+
+CODE_CACHE_VERSION = 1
+DEFAULT_CODE_CACHE_SIZE = 64 * 1024 * 1024
+
+_MAGIC = b"lvdc"
+_PREFIX = "lvm_decode_"
+_SUFFIX = ".bin"
+# 文件头: magic, 缓存格式版本, LVM_VERSION, text的SHA-256, 入口地址, 指令数, 操作数个数, 块起始地址数
+_HEADER = struct.Struct('<4sIQ32sQIII')
+# 指令记录: pc, next_pc, 操作数在操作数表中的起始下标, opcode, 操作数个数
+_RECORD = struct.Struct('<QQIHH')
+_VALUE = struct.Struct('<Q')
+
+Instructions = dict[int, tuple[int, tuple[int, ...], int]]
+
+
+class CodeCache:
+    """
+      预解码结果的磁盘缓存, 类似 __pycache__
+
+      每个文件以text段的SHA-256、入口地址 (基本块起始地址依赖于它) 与LVM_VERSION命名,
+      保存text段的指令表与基本块起始地址.
+      文件由定长记录组成, 读取时整体mmap并用struct批量解析, 不再逐条从内存解码.
+      写入先写临时文件再 os.replace, 多个进程可以同时写同一目录;
+      命中时更新文件的修改时间, 目录总大小超过 max_size 时按修改时间淘汰最久未用的文件
+    """
+
+    def __init__(self, directory: str, max_size: int = DEFAULT_CODE_CACHE_SIZE):
+        self.directory = directory
+        self.max_size = max_size
+        self.stats = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+
+    def path(self, text_hash: str, entrypoint: int, version: int) -> str:
+        return os.path.join(self.directory, f"{_PREFIX}{text_hash[:32]}_{entrypoint:x}_v{version}{_SUFFIX}")
+
+    def load(self, text, entrypoint: int, version: int) -> Optional[tuple[Instructions, list[int]]]:
+        """返回缓存的 (指令表, 基本块起始地址), 不存在、已过期或已损坏时返回None"""
+        digest = hashlib.sha256(text).digest()
+        path = self.path(digest.hex(), entrypoint, version)
+        try:
+            with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapping:
+                with memoryview(mapping) as view:
+                    result = self._parse(view, digest, entrypoint, version)
+        except (OSError, ValueError, struct.error):
+            result = None
+        if result is None:
+            self.stats["misses"] += 1
+            return None
+
+        self.stats["hits"] += 1
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return result
+
+    def store(self, text, entrypoint: int, version: int, instructions: Instructions, leaders: list[int]):
+        """写入缓存文件并按大小上限淘汰旧文件; 写入失败时静默放弃"""
+        digest = hashlib.sha256(text).digest()
+        operands = []
+        records = bytearray()
+        for pc, (code, values, next_pc) in sorted(instructions.items()):
+            records.extend(_RECORD.pack(pc, next_pc, len(operands), code, len(values)))
+            operands.extend(values)
+
+        path = self.path(digest.hex(), entrypoint, version)
+        temporary = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(temporary, "wb") as f:
+                f.write(_HEADER.pack(_MAGIC, CODE_CACHE_VERSION, version, digest, entrypoint,
+                                     len(instructions), len(operands), len(leaders)))
+                f.write(records)
+                f.write(struct.pack(f"<{len(operands)}Q", *operands))
+                f.write(struct.pack(f"<{len(leaders)}Q", *leaders))
+            os.replace(temporary, path)
+        except OSError:
+            try:
+                os.remove(temporary)
+            except OSError:
+                pass
+            return
+        self.stats["stores"] += 1
+        self.evict()
+
+    def evict(self):
+        """删除最久未用的缓存文件, 直到总大小不超过 max_size"""
+        files = []
+        total = 0
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return
+        for name in names:
+            if not (name.startswith(_PREFIX) and name.endswith(_SUFFIX)):
+                continue
+            try:
+                status = os.stat(os.path.join(self.directory, name))
+            except OSError:
+                # 已被其他进程删除
+                continue
+            files.append((status.st_mtime, status.st_size, name))
+            total += status.st_size
+
+        files.sort()
+        for _, size, name in files:
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(os.path.join(self.directory, name))
+                self.stats["evictions"] += 1
+            except OSError:
+                pass
+            total -= size
+
+    @staticmethod
+    def _parse(view: memoryview, digest: bytes, entrypoint: int,
+               version: int) -> Optional[tuple[Instructions, list[int]]]:
+        (magic, cache_version, lvm_version, text_digest, cached_entrypoint,
+         count, operand_count, leader_count) = _HEADER.unpack_from(view, 0)
+        if (magic != _MAGIC or cache_version != CODE_CACHE_VERSION or lvm_version != version or
+                text_digest != digest or cached_entrypoint != entrypoint):
+            return None
+        offset = _HEADER.size
+        end = offset + count * _RECORD.size
+        operands = struct.unpack_from(f"<{operand_count}Q", view, end)
+        leaders = list(struct.unpack_from(f"<{leader_count}Q", view, end + operand_count * _VALUE.size))
+
+        instructions: Instructions = {}
+        for pc, next_pc, start, code, length in _RECORD.iter_unpack(view[offset:end]):
+            instructions[pc] = (code, operands[start:start + length], next_pc)
+        return instructions, leaders
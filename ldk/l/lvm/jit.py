@@ -0,0 +1,201 @@
+from ldk.l.lvm.aot import (
+    emit_fallback, emit_inline, operand_names, register_effects
+)
+from ldk.l.lvm.vm import (
+    ByteCode, SuperInstruction, DISPATCH_TABLE, _CONDITIONS, _FLAG_MASK, _divide, _modulo
+)
+
+DEFAULT_JIT_THRESHOLD = 50
+MAX_TRACE_LENGTH = 256
+
+_PC = ByteCode.PC_REGISTER
+_SP = ByteCode.SP_REGISTER
+
+# 会写内存的指令, 执行后需要检查是否写到了可执行页
+_MEMORY_WRITES = {
+    ByteCode.PUSH_1, ByteCode.PUSH_2, ByteCode.PUSH_4, ByteCode.PUSH_8,
+    ByteCode.STORE_1, ByteCode.STORE_2, ByteCode.STORE_4, ByteCode.STORE_8,
+    ByteCode.CREATE_FRAME
+}
+
+
+class Trace:
+    __slots__ = ('head', 'function', 'generation', 'length')
+
+    def __init__(self, head: int, function, generation: int, length: int):
+        self.head = head
+        self.function = function
+        self.generation = generation
+        self.length = length
+
+
+class TraceJIT:
+    """
+      热循环的分层编译
+
+      解释器在向后跳转时为循环头计数, 超过阈值后逐条执行并记录一次循环路径,
+      再把路径编译为Python闭包. 之后每次到达循环头都在闭包中执行,
+      直到离开路径或守卫失败 (条件跳转方向即标志位状态、间接跳转目标、可执行页被写入),
+      此时把寄存器写回并回到解释器.
+    """
+
+    def __init__(self, virtual_machine, threshold: int = DEFAULT_JIT_THRESHOLD):
+        self.virtual_machine = virtual_machine
+        self.threshold = threshold
+        self.counters: dict[int, int] = {}
+        self.traces: dict[int, Trace] = {}
+        self.blacklist: set[int] = set()
+        self.stats = {"compiled": 0, "aborted": 0, "entered": 0, "invalidated": 0}
+        self.handlers = self._build_handlers()
+
+    def _build_handlers(self) -> list:
+        """在分派表的跳转处理函数外包一层向后跳转检测"""
+        handlers = list(DISPATCH_TABLE)
+        codes = [ByteCode.JUMP, ByteCode.JUMP_IMMEDIATE, SuperInstruction.CMP_JUMP]
+        codes.extend(range(ByteCode.JE, ByteCode.JUGE + 1))
+        for code in codes:
+            handlers[code] = self._wrap_jump(DISPATCH_TABLE[code])
+        return handlers
+
+    def _wrap_jump(self, handler):
+        def wrapper(eu, registers, memory, operands):
+            next_pc = registers[_PC]
+            handler(eu, registers, memory, operands)
+            if registers[_PC] < next_pc:
+                self.backward_branch(eu, registers, memory)
+
+        return wrapper
+
+    def backward_branch(self, eu, registers: list[int], memory):
+        head = registers[_PC]
+        trace = self.traces.get(head)
+        if trace is None:
+            if head in self.blacklist:
+                return
+            count = self.counters.get(head, 0) + 1
+            self.counters[head] = count
+            if count < self.threshold:
+                return
+            trace = self.record(eu, registers, memory, head)
+            if trace is None or not eu.running:
+                return
+
+        self.stats["entered"] += 1
+        registers[_PC] = trace.function(eu, registers, memory)
+        if memory.instruction_cache.generation != trace.generation:
+            # 可执行页已被改写, 丢弃路径并重新计数
+            self.traces.pop(head, None)
+            self.counters[head] = 0
+            self.stats["invalidated"] += 1
+
+    def record(self, eu, registers: list[int], memory, head: int) -> Trace | None:
+        """从循环头开始逐条执行并记录路径, 回到循环头时编译"""
+        cache = memory.instruction_cache
+        generation = cache.generation
+        path = []
+        pc = head
+        while len(path) < MAX_TRACE_LENGTH:
+            code, operands, next_pc = cache.read(pc)
+            if code not in ByteCode.instruction_names:
+                break
+            taken = ByteCode.is_conditional_jump(code) and \
+                _CONDITIONS[code - ByteCode.JE][eu.flags & _FLAG_MASK]
+            registers[_PC] = next_pc
+            DISPATCH_TABLE[code](eu, registers, memory, operands)
+            path.append((pc, code, operands, next_pc, registers[_PC], taken))
+            if not eu.running or cache.generation != generation:
+                break
+            pc = registers[_PC]
+            if pc == head:
+                trace = Trace(head, compile_trace(head, path, cache, generation), generation, len(path))
+                self.traces[head] = trace
+                self.stats["compiled"] += 1
+                return trace
+
+        self.blacklist.add(head)
+        self.stats["aborted"] += 1
+        return None
+
+
+def compile_trace(head: int, path: list[tuple], cache, generation: int):
+    """把记录的路径编译为在循环内反复执行的闭包, 返回离开路径时的PC"""
+    used, written = set(), set()
+    for _, code, operands, _, _, _ in path:
+        reads, writes = register_effects(code, operands)
+        used |= reads | writes
+        written |= writes
+    used.discard(_PC)
+    written.discard(_PC)
+
+    flush = [f"r[{register}] = r{register}" for register in sorted(written)] + ["eu.flags = flags"]
+    reload = [f"r{register} = r[{register}]" for register in sorted(used)] + ["flags = eu.flags"]
+
+    def leave(target: str) -> list[str]:
+        return [*flush, f"return {target}"]
+
+    def guard(condition: str, target: str) -> list[str]:
+        return [f"if {condition}:", *("    " + line for line in leave(target))]
+
+    body = []
+    body.extend(guard("not eu.running or cache.generation != GENERATION", str(head)))
+    for _, code, operands, next_pc, new_pc, taken in path:
+        names = operand_names(code, operands, next_pc)
+        writes = register_effects(code, operands)[1]
+        body.append(f"# {ByteCode.instruction_names[code]} {operands}")
+        if _PC in writes:
+            body.append(f"r{_PC} = {next_pc}")
+
+        if ByteCode.is_conditional_jump(code):
+            condition = f"C{code - ByteCode.JE}[flags & 7]"
+            if taken:
+                body.extend(guard(f"not {condition}", str(next_pc)))
+                body.extend(guard(f"{names[0]} != {new_pc}", names[0]))
+            else:
+                body.extend(guard(condition, names[0]))
+            continue
+        if code == ByteCode.JUMP:
+            body.extend(guard(f"{names[0]} != {new_pc}", names[0]))
+            continue
+        if code == ByteCode.JUMP_IMMEDIATE:
+            continue
+        if code in (ByteCode.INVOKE, ByteCode.INVOKE_IMMEDIATE):
+            body.append(f"r{_SP} = r{_SP} - 8")
+            body.append(f"m.set_long(r{_SP}, {next_pc})")
+            body.extend(guard("cache.generation != GENERATION", str(new_pc)))
+            if code == ByteCode.INVOKE:
+                body.extend(guard(f"{names[0]} != {new_pc}", names[0]))
+            continue
+        if code == ByteCode.RETURN:
+            body.append(f"target = m.get_long(r{_SP})")
+            body.append(f"r{_SP} = r{_SP} + 8")
+            body.extend(guard(f"target != {new_pc}", "target"))
+            continue
+
+        inline = emit_inline(code, operands, names)
+        if inline is None:
+            body.extend(emit_fallback(code, operands, next_pc, flush, reload))
+            body.extend(guard("cache.generation != GENERATION", str(next_pc)))
+        else:
+            body.extend(inline)
+            if code in _MEMORY_WRITES:
+                body.extend(guard("cache.generation != GENERATION", str(next_pc)))
+        if _PC in writes:
+            body.extend(guard(f"r{_PC} != {new_pc}", f"r{_PC}"))
+
+    lines = ["def trace(eu, r, m):"]
+    lines.extend(f"    r{register} = r[{register}]" for register in sorted(used))
+    lines.append("    flags = eu.flags")
+    lines.append("    while True:")
+    lines.extend("        " + line for line in body)
+
+    namespace = {
+        "H": DISPATCH_TABLE,
+        "MASK64": 0xFFFFFFFFFFFFFFFF,
+        "cache": cache,
+        "GENERATION": generation,
+        "_divide": _divide,
+        "_modulo": _modulo
+    }
+    namespace.update({f"C{i}": condition for i, condition in enumerate(_CONDITIONS)})
+    exec(compile("\n".join(lines), f"<lvm-trace-{head:x}>", "exec"), namespace)
+    return namespace["trace"]
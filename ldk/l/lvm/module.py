@@ -1,7 +1,119 @@
+import lzma
+import mmap
+import struct
+import zlib
+from typing import Optional
+
 from hairinne.utils.Incomplete import incompleted
-from hairinne.utils.byteAndLong import toBytearray, toLong, getFromEnd
-LVM_VERSION = 0  # Range: long range ( 2^63-1=9223372036854775807 )
+LVM_VERSION = 3  # Range: long range ( 2^63-1=9223372036854775807 )
+
+MAGIC = b"lvme"
+PAGE_SIZE = 4096
+# 从此版本起模块使用带段表的页对齐格式, 更早的版本是紧密排列的 text/rodata/data
+SECTIONED_VERSION = 3
+
+TEXT_SECTION = 1
+RODATA_SECTION = 2
+DATA_SECTION = 3
+
+# 段权限, 与 MemoryPageFlag 的取值相同
+SECTION_READ = 1
+SECTION_WRITE = 2
+SECTION_EXEC = 4
+SECTION_PERMISSIONS = SECTION_READ | SECTION_WRITE | SECTION_EXEC
+
+# 段压缩方式: 内容是每页一个独立压缩块, 前面是各块长度 (uint32) 组成的表
+SECTION_ZLIB = 0x100
+SECTION_LZMA = 0x200
+SECTION_COMPRESSION = SECTION_ZLIB | SECTION_LZMA
+
+_COMPRESSORS = {
+    SECTION_ZLIB: (zlib.compress, zlib.decompress),
+    SECTION_LZMA: (lzma.compress, lzma.decompress)
+}
+
+_LENGTH = struct.Struct('<Q')
+_HEADER = struct.Struct('<4sQ')
+# 带段表的格式: magic, version, entrypoint, bss长度, 段数
+_SECTIONED_HEADER = struct.Struct('<4sQQQI')
+# 段表项: 类型, 标志 (低3位为权限, 0x300为压缩方式), 装入地址, 文件偏移, 长度 (解压后)
+_SECTION_ENTRY = struct.Struct('<IIQQQ')
+
+_DEFAULT_PERMISSIONS = {
+    TEXT_SECTION: SECTION_READ | SECTION_EXEC,
+    RODATA_SECTION: SECTION_READ,
+    DATA_SECTION: SECTION_READ | SECTION_WRITE
+}
+
+
+def _alignPage(value: int) -> int:
+    return (value + PAGE_SIZE - 1) & -PAGE_SIZE
+
 
+class Section:
+    """
+      模块中的一段: 类型、标志 (权限与压缩方式)、装入地址与内容
+
+      未压缩时 content 可以比 length 长 (文件中末尾填充到整页的0), 只有前 length 字节属于本段;
+      压缩时 content 是块长度表加各页的压缩块, length 是解压后的长度, 各页可以单独解压;
+      decompressed 记录由内存页首次访问时经 load 解压的页号
+    """
+    __slots__ = ('kind', 'flags', 'address', 'length', 'content', 'chunks', 'decompressed')
+
+    def __init__(self, kind: int, flags: int, address: int, content, length: Optional[int] = None):
+        self.kind = kind
+        self.flags = flags
+        self.address = address
+        self.length = len(content) if length is None else length
+        self.chunks: Optional[list[tuple[int, int]]] = None
+        # 由内存页按需解压过的页号
+        self.decompressed: set[int] = set()
+        if flags & SECTION_COMPRESSION:
+            pages = self.pageCount()
+            offset = 4 * pages
+            self.chunks = []
+            for size in struct.unpack_from(f"<{pages}I", content, 0):
+                self.chunks.append((offset, offset + size))
+                offset += size
+            if offset > len(content):
+                raise Exception("Invalid module format")
+            content = content[:offset]
+        self.content = content
+
+    @property
+    def compressed(self) -> bool:
+        return self.chunks is not None
+
+    @property
+    def data(self):
+        if self.chunks is None:
+            return self.content[:self.length]
+        return b"".join(self.page(index) for index in range(self.pageCount()))[:self.length]
+
+    def pageCount(self) -> int:
+        return (self.length + PAGE_SIZE - 1) // PAGE_SIZE
+
+    def page(self, index: int):
+        """返回第index页的内容, 最后一页可能不足一页"""
+        if self.chunks is None:
+            return self.content[index * PAGE_SIZE:min((index + 1) * PAGE_SIZE, self.length)]
+        start, end = self.chunks[index]
+        return _COMPRESSORS[self.flags & SECTION_COMPRESSION][1](self.content[start:end])
+
+    def load(self, index: int, record: bool = True):
+        """供内存页在首次访问时取回第index页, 并记入 decompressed; record为False时只取内容 (如写入快照)"""
+        if record:
+            self.decompressed.add(index)
+        return self.page(index)
+
+    def compress(self, compression: int) -> "Section":
+        """返回按页压缩后的段, compression 为 SECTION_ZLIB 或 SECTION_LZMA"""
+        data = self.data
+        compressor = _COMPRESSORS[compression][0]
+        blocks = [compressor(data[start:start + PAGE_SIZE]) for start in range(0, self.length, PAGE_SIZE)]
+        content = struct.pack(f"<{len(blocks)}I", *map(len, blocks)) + b"".join(blocks)
+        flags = (self.flags & ~SECTION_COMPRESSION) | compression
+        return Section(self.kind, flags, self.address, content, self.length)
 
 
 class Module:
@@ -11,40 +123,176 @@ class Module:
             rodata: bytes,
             data: bytes,
             bssSectionLength: int,
-            entrypoint: int
+            entrypoint: int,
+            sections: Optional[list[Section]] = None
     ):
-        self.text = text
-        self.rodata = rodata
-        self.data = data
+        """
+          sections 缺省时三段按旧格式的方式从地址0起依次紧密排列;
+          给出 sections 时忽略 text/rodata/data, 三者改由对应类型的第一个段提供
+        """
         self.bssSectionLength = bssSectionLength
         self.entrypoint = entrypoint
+        if sections is None:
+            sections = []
+            address = 0
+            for kind, content in ((TEXT_SECTION, text), (RODATA_SECTION, rodata), (DATA_SECTION, data)):
+                sections.append(Section(kind, _DEFAULT_PERMISSIONS[kind], address, content))
+                address += len(content)
+        self.sections = sections
+
+    @property
+    def text(self):
+        return self._sectionData(TEXT_SECTION)
+
+    @property
+    def rodata(self):
+        return self._sectionData(RODATA_SECTION)
+
+    @property
+    def data(self):
+        return self._sectionData(DATA_SECTION)
+
+    def _sectionData(self, kind: int):
+        section = self.section(kind)
+        return section.data if section is not None else b""
+
+    def section(self, kind: int) -> Optional[Section]:
+        """返回指定类型的第一个段, 不存在时返回None"""
+        for section in self.sections:
+            if section.kind == kind:
+                return section
+        return None
+
+    def decompressedPages(self) -> int:
+        """各压缩段中由内存页按需解压过的页数"""
+        return sum(len(section.decompressed) for section in self.sections)
+
+    def compress(self, compression: int = SECTION_ZLIB,
+                 kinds: tuple[int, ...] = (RODATA_SECTION, DATA_SECTION)) -> "Module":
+        """返回把指定类型的段按页压缩后的模块"""
+        sections = [section.compress(compression) if section.kind in kinds and not section.compressed
+                    else section for section in self.sections]
+        return Module.fromSections(sections, self.bssSectionLength, self.entrypoint)
+
+    @staticmethod
+    def fromSections(sections: list[Section], bssSectionLength: int, entrypoint: int) -> "Module":
+        return Module(b"", b"", b"", bssSectionLength, entrypoint, sections)
+
+    @staticmethod
+    def pageAligned(text: bytes, rodata: bytes, data: bytes, bssSectionLength: int,
+                    entrypoint: int) -> "Module":
+        """各段从新的一页开始装入, 每页只属于一个段, 权限与段一致"""
+        sections = []
+        address = 0
+        for kind, content in ((TEXT_SECTION, text), (RODATA_SECTION, rodata), (DATA_SECTION, data)):
+            sections.append(Section(kind, _DEFAULT_PERMISSIONS[kind], address, content))
+            address = _alignPage(address + len(content))
+        return Module.fromSections(sections, bssSectionLength, entrypoint)
 
     def raw(self) -> bytearray:
+        """
+          按带段表的格式输出
+
+          第一页是文件头与段表, 各段内容从页边界开始并以0填充到整页,
+          使得段可以按页直接映射
+        """
+        byte_buffer = bytearray()
+        byte_buffer.extend(_SECTIONED_HEADER.pack(MAGIC, LVM_VERSION, self.entrypoint,
+                                                  self.bssSectionLength, len(self.sections)))
+        offset = _alignPage(_SECTIONED_HEADER.size + _SECTION_ENTRY.size * len(self.sections))
+        contents = [section.content if section.compressed else section.data for section in self.sections]
+        for section, content in zip(self.sections, contents):
+            byte_buffer.extend(_SECTION_ENTRY.pack(section.kind, section.flags, section.address,
+                                                   offset, section.length))
+            offset += _alignPage(len(content))
+        for content in contents:
+            byte_buffer.extend(bytes(_alignPage(len(byte_buffer)) - len(byte_buffer)))
+            byte_buffer.extend(content)
+        byte_buffer.extend(bytes(_alignPage(len(byte_buffer)) - len(byte_buffer)))
+        return byte_buffer
+
+    def rawPacked(self) -> bytearray:
+        """按旧的紧密排列格式输出, 只能表示默认的段布局"""
         byte_buffer = bytearray()
-        byte_buffer.extend([ord(i) for i in "lvme"])
-        byte_buffer.extend(toBytearray(LVM_VERSION))
-        byte_buffer.extend(toBytearray(len(self.text)))
-        byte_buffer.extend(self.text)
-        byte_buffer.extend(toBytearray(len(self.rodata)))
-        byte_buffer.extend(self.rodata)
-        byte_buffer.extend(toBytearray(len(self.data)))
-        byte_buffer.extend(self.data)
-        byte_buffer.extend(toBytearray(self.bssSectionLength))
-        byte_buffer.extend(toBytearray(self.entrypoint))
+        byte_buffer.extend(_HEADER.pack(MAGIC, SECTIONED_VERSION - 1))
+        for section in (self.text, self.rodata, self.data):
+            byte_buffer.extend(_LENGTH.pack(len(section)))
+            byte_buffer.extend(section)
+        byte_buffer.extend(_LENGTH.pack(self.bssSectionLength))
+        byte_buffer.extend(_LENGTH.pack(self.entrypoint))
         return byte_buffer
 
     @staticmethod
-    def fromRaw(raw: bytearray) -> "Module":
-        if getFromEnd(raw, 4) != [ord(i) for i in "lvme"]:
+    def fromRaw(raw) -> "Module":
+        """
+          解析模块, 根据版本号选择带段表的格式或旧的紧密排列格式
+
+          raw可以是bytes、bytearray、mmap等任意支持缓冲区协议的对象;
+          各段内容是raw上的memoryview切片, 不复制数据
+        """
+        view = memoryview(raw).cast('B')
+        try:
+            magic, version = _HEADER.unpack_from(view, 0)
+        except struct.error:
+            raise Exception("Invalid module format")
+        if magic != MAGIC:
             raise Exception("Invalid module format")
-        if toLong(getFromEnd(raw, 8)) > LVM_VERSION:
+        if version > LVM_VERSION:
             raise Exception("Unsupported module version")
-        textLength = toLong(getFromEnd(raw, 8))
-        text = getFromEnd(raw, textLength)
-        rodataLength = toLong(getFromEnd(raw, 8))
-        rodata = getFromEnd(raw, rodataLength)
-        dataLength = toLong(getFromEnd(raw, 8))
-        data = getFromEnd(raw, dataLength)
-        bssLength = toLong(getFromEnd(raw, 8))
-        entrypoint = toLong(getFromEnd(raw, 8))
-        return Module(text, rodata, data, bssLength, entrypoint)
+
+        try:
+            if version >= SECTIONED_VERSION:
+                return Module._fromSectioned(view)
+            return Module._fromPacked(view)
+        except struct.error:
+            raise Exception("Invalid module format")
+
+    @staticmethod
+    def _fromPacked(view: memoryview) -> "Module":
+        offset = _HEADER.size
+        sections = []
+        for _ in range(3):
+            length, = _LENGTH.unpack_from(view, offset)
+            offset += _LENGTH.size
+            if offset + length > len(view):
+                raise Exception("Invalid module format")
+            sections.append(view[offset:offset + length])
+            offset += length
+        bssLength, = _LENGTH.unpack_from(view, offset)
+        entrypoint, = _LENGTH.unpack_from(view, offset + _LENGTH.size)
+        return Module(sections[0], sections[1], sections[2], bssLength, entrypoint)
+
+    @staticmethod
+    def _fromSectioned(view: memoryview) -> "Module":
+        _, _, entrypoint, bssLength, count = _SECTIONED_HEADER.unpack_from(view, 0)
+        sections = []
+        for index in range(count):
+            kind, flags, address, offset, length = _SECTION_ENTRY.unpack_from(
+                view, _SECTIONED_HEADER.size + index * _SECTION_ENTRY.size)
+            if (flags & (SECTION_PERMISSIONS | SECTION_COMPRESSION) != flags or
+                    flags & SECTION_COMPRESSION == SECTION_COMPRESSION):
+                raise Exception("Invalid module format")
+            if kind == TEXT_SECTION and address != 0:
+                # 预解码与AOT翻译都假定text段从地址0开始
+                raise Exception("Invalid module format")
+            if flags & SECTION_COMPRESSION:
+                # 压缩段的存储长度由其块长度表决定
+                sections.append(Section(kind, flags, address, view[offset:], length))
+                continue
+            if offset + length > len(view):
+                raise Exception("Invalid module format")
+            # 连同末尾的填充一起引用, 使最后一页也能整页映射
+            end = min(offset + _alignPage(length), len(view))
+            sections.append(Section(kind, flags, address, view[offset:end], length))
+        return Module.fromSections(sections, bssLength, entrypoint)
+
+    @staticmethod
+    def load(path: str) -> "Module":
+        """以只读方式mmap模块文件并解析, 各段直接引用映射的文件内容"""
+        with open(path, "rb") as f:
+            try:
+                mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                # 空文件无法映射
+                raise Exception("Invalid module format")
+        return Module.fromRaw(mapping)
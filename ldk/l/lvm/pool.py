@@ -0,0 +1,184 @@
+import collections
+import os
+import pickle
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+from ldk.l.lvm.module import Module
+from ldk.l.lvm.vm import ThreadHandle, VirtualMachine
+
+POOL_CLONE = "clone"
+POOL_FORK = "fork"
+POOL_MODES = (POOL_CLONE, POOL_FORK)
+
+DEFAULT_POOL_SIZE = 4
+# 每种操作保留的最近耗时样本数
+LATENCY_SAMPLES = 10000
+
+
+def percentile(samples, fraction: float) -> float:
+    """最近秩法求百分位数, 无样本时返回0"""
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = max(0, min(len(ordered) - 1, int(fraction * len(ordered) + 0.5) - 1))
+    return ordered[index]
+
+
+class VirtualMachinePool:
+    """
+      预热的虚拟机池
+
+      构造时只创建一次模板虚拟机: 加载模块并创建 (不启动) 主线程, 然后写入快照.
+      clone 模式下池中的虚拟机都从该快照恢复, 页直接引用映射的快照并在写入时复制,
+      归还时再次恢复即完成重置; fork 模式下每个任务在 os.fork 出的子进程中使用模板虚拟机,
+      由操作系统完成写时复制, 子进程把任务结果经管道交回, 同时运行的子进程不超过 size 个.
+      acquire/release 的耗时由 latency_percentiles 报告
+    """
+
+    def __init__(self, module: Module, size: int = DEFAULT_POOL_SIZE, mode: str = POOL_CLONE,
+                 stack_size: int = 4194304, **options):
+        if mode not in POOL_MODES:
+            raise ValueError(f"Unknown pool mode: {mode}")
+        if mode == POOL_FORK and not hasattr(os, "fork"):
+            raise RuntimeError("Fork pools are not supported on this platform")
+        if size <= 0:
+            raise ValueError(f"Pool size must be positive: {size}")
+        self.size = size
+        self.mode = mode
+        self.stack_size = stack_size
+        self.directory = tempfile.mkdtemp(prefix="lvm-pool-")
+        if options.get("dispatch") == VirtualMachine.DISPATCH_AOT and not options.get("aot_cache_dir"):
+            # 恢复快照时会重新翻译text段, 借助磁盘缓存只翻译一次
+            options["aot_cache_dir"] = os.path.join(self.directory, "aot")
+        self.options = options
+        self.snapshot_path = os.path.join(self.directory, "template.lvms")
+
+        self.template = self._create_virtual_machine()
+        self.template.init(module)
+        execution_unit = self.template._create_execution_unit(self.template._get_thread_id(),
+                                                              self.template.entry_point)
+        self.template.thread_id_to_handle[execution_unit.threadID] = ThreadHandle(execution_unit)
+        self.template.snapshot(self.snapshot_path)
+
+        self.idle: list[VirtualMachine] = []
+        self.latencies = {
+            "acquire": collections.deque(maxlen=LATENCY_SAMPLES),
+            "release": collections.deque(maxlen=LATENCY_SAMPLES)
+        }
+        self.lock = threading.Lock()
+        # fork 模式下限制同时运行的子进程数
+        self.slots = threading.BoundedSemaphore(size)
+        if mode == POOL_CLONE:
+            for _ in range(size):
+                self.idle.append(self._clone())
+
+    def acquire(self) -> VirtualMachine:
+        """取出一个可直接 run() 的虚拟机, 池空时现场克隆"""
+        if self.mode != POOL_CLONE:
+            raise RuntimeError("acquire/release are only available in clone mode, use submit")
+        start = time.perf_counter()
+        with self.lock:
+            virtual_machine = self.idle.pop() if self.idle else None
+        if virtual_machine is None:
+            virtual_machine = self._clone()
+        self._record("acquire", start)
+        return virtual_machine
+
+    def release(self, virtual_machine: VirtualMachine):
+        """把虚拟机恢复到模板状态后放回池中, 池已满时丢弃"""
+        start = time.perf_counter()
+        with self.lock:
+            full = len(self.idle) >= self.size
+        if not full:
+            virtual_machine.restore(self.snapshot_path)
+            with self.lock:
+                self.idle.append(virtual_machine)
+        self._record("release", start)
+
+    def submit(self, job):
+        """
+          用一个虚拟机执行 job(virtual_machine) 并返回其结果
+
+          fork 模式下job在子进程中运行, 返回值必须可以pickle, 子进程中的异常以RuntimeError重新抛出;
+          已有 size 个子进程在运行时等待其中之一结束, 等待时间计入acquire耗时
+        """
+        if self.mode == POOL_CLONE:
+            virtual_machine = self.acquire()
+            try:
+                return job(virtual_machine)
+            finally:
+                self.release(virtual_machine)
+
+        start = time.perf_counter()
+        self.slots.acquire()
+        try:
+            return self._run_forked(job, start)
+        finally:
+            self.slots.release()
+
+    def _run_forked(self, job, start: float):
+        # 避免子进程重复输出父进程缓冲区中的内容
+        sys.stdout.flush()
+        sys.stderr.flush()
+        read_fd, write_fd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(read_fd)
+            try:
+                payload = pickle.dumps((True, job(self.template)))
+            except BaseException as e:
+                payload = pickle.dumps((False, f"{type(e).__name__}: {e}"))
+            with os.fdopen(write_fd, "wb") as f:
+                f.write(payload)
+            os._exit(0)
+
+        os.close(write_fd)
+        self._record("acquire", start)
+        with os.fdopen(read_fd, "rb") as f:
+            data = f.read()
+        start = time.perf_counter()
+        os.waitpid(pid, 0)
+        self._record("release", start)
+        if not data:
+            raise RuntimeError("Pool worker exited without a result")
+        succeeded, value = pickle.loads(data)
+        if not succeeded:
+            raise RuntimeError(f"Pool job failed: {value}")
+        return value
+
+    def latency_percentiles(self, fractions=(0.5, 0.9, 0.99)) -> dict[str, dict[str, float]]:
+        """返回 acquire/release 耗时 (秒) 的百分位数, 如 {"acquire": {"p50": ..., "p99": ...}}"""
+        with self.lock:
+            samples = {name: list(values) for name, values in self.latencies.items()}
+        return {
+            name: {f"p{fraction * 100:g}": percentile(values, fraction) for fraction in fractions}
+            for name, values in samples.items()
+        }
+
+    def close(self):
+        with self.lock:
+            self.idle.clear()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def __enter__(self) -> "VirtualMachinePool":
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _create_virtual_machine(self) -> VirtualMachine:
+        return VirtualMachine(self.stack_size, **self.options)
+
+    def _clone(self) -> VirtualMachine:
+        virtual_machine = self._create_virtual_machine()
+        virtual_machine.restore(self.snapshot_path)
+        return virtual_machine
+
+    def _record(self, name: str, start: float):
+        elapsed = time.perf_counter() - start
+        with self.lock:
+            self.latencies[name].append(elapsed)
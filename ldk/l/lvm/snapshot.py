@@ -0,0 +1,281 @@
+import mmap
+import os
+import struct
+import threading
+
+from ldk.l.lvm.vm import (
+    ExecutionUnit, FileHandle, Memory, MemoryPage, MemoryPageFlag, MemoryRegion, ThreadHandle, VirtualMachine
+)
+
+# 快照格式: 文件头之后是元数据, 即一串以长度开头的uint64数组 (寄存器等可能为负的值用16字节有符号整数,
+# 路径用UTF-8), 依次为虚拟机标量、页表、分配器空闲表、空闲区间、线程栈、无主块、区域、执行单元与文件表.
+# 元数据之后从页边界开始依次存放各页的内容. 恢复时以只读方式mmap整个文件, 页直接引用映射的内容
+# 并在首次写入时复制 (MP_COW), 因此恢复的开销与页数而不是内存大小成正比
+SNAPSHOT_MAGIC = b"lvms"
+SNAPSHOT_VERSION = 2
+
+# 文件头: magic, 快照格式版本, LVM_VERSION, 大页大小, text段长度, 元数据长度, 内存页数
+_HEADER = struct.Struct('<4sIQQQQQ')
+_COUNT = struct.Struct('<Q')
+_SIGNED_SIZE = 16
+
+# 页记录中的内容类型
+_PAGE_ABSENT = 0
+_PAGE_ZERO = 1
+_PAGE_DATA = 2
+
+_PERMISSIONS = MemoryPageFlag.MP_READ | MemoryPageFlag.MP_WRITE | MemoryPageFlag.MP_EXEC
+
+
+class SnapshotWriter:
+    def __init__(self):
+        self.buffer = bytearray()
+
+    def values(self, values):
+        values = list(values)
+        self.buffer.extend(_COUNT.pack(len(values)))
+        self.buffer.extend(struct.pack(f"<{len(values)}Q", *values))
+
+    def signed(self, values):
+        values = list(values)
+        self.buffer.extend(_COUNT.pack(len(values)))
+        for value in values:
+            self.buffer.extend(value.to_bytes(_SIGNED_SIZE, "little", signed=True))
+
+    def string(self, text: str):
+        data = text.encode("utf-8")
+        self.buffer.extend(_COUNT.pack(len(data)))
+        self.buffer.extend(data)
+
+
+class SnapshotReader:
+    def __init__(self, view: memoryview, offset: int):
+        self.view = view
+        self.offset = offset
+
+    def _count(self) -> int:
+        count, = _COUNT.unpack_from(self.view, self.offset)
+        self.offset += _COUNT.size
+        return count
+
+    def values(self) -> tuple[int, ...]:
+        count = self._count()
+        values = struct.unpack_from(f"<{count}Q", self.view, self.offset)
+        self.offset += count * 8
+        return values
+
+    def signed(self) -> list[int]:
+        count = self._count()
+        values = []
+        for _ in range(count):
+            values.append(int.from_bytes(self.view[self.offset:self.offset + _SIGNED_SIZE], "little", signed=True))
+            self.offset += _SIGNED_SIZE
+        return values
+
+    def string(self) -> str:
+        count = self._count()
+        text = bytes(self.view[self.offset:self.offset + count]).decode("utf-8")
+        self.offset += count
+        return text
+
+
+def _pairs(values) -> list[tuple[int, ...]]:
+    return list(zip(values[0::2], values[1::2]))
+
+
+def _align_page(value: int) -> int:
+    return (value + MemoryPage.PAGE_SIZE - 1) & -MemoryPage.PAGE_SIZE
+
+
+def _check_stopped(virtual_machine: VirtualMachine):
+    for handle in virtual_machine.thread_id_to_handle.values():
+        if handle.thread.is_alive():
+            raise RuntimeError("Cannot snapshot or restore while threads are running")
+
+
+def write_snapshot(virtual_machine: VirtualMachine, path: str):
+    """写入快照; 先写临时文件再替换, 不会留下不完整的快照"""
+    _check_stopped(virtual_machine)
+    memory = virtual_machine.memory
+    writer = SnapshotWriter()
+    with memory.lock:
+        writer.values([virtual_machine.entry_point, virtual_machine.last_thread_id,
+                       virtual_machine.last_fd, memory.last_region_id])
+
+        # 页表: 地址, 标志, 引用计数, 内容类型
+        pages = []
+        records = []
+        for page_number, page in memory.memory_page_table.items():
+            address = page_number << MemoryPage.PAGE_SHIFT if page_number >= 0 \
+                else ~page_number << memory.large_page_shift
+            with page._arena.lock:
+                if page._loader is not None:
+                    # 尚未解压的页在快照中保存解压后的内容, 本虚拟机中的页仍保持延迟加载
+                    kind = _PAGE_DATA
+                    pages.append(page.peek())
+                elif not page.flags & MemoryPageFlag.MP_PRESENT:
+                    kind = _PAGE_ABSENT
+                elif page.data is page._arena.zero_page:
+                    kind = _PAGE_ZERO
+                else:
+                    kind = _PAGE_DATA
+                    pages.append(page.data)
+            records.extend((address, page.flags, page.ref_count, kind))
+        writer.values(records)
+
+        for free_list in memory.small_free_lists:
+            writer.values(free_list)
+        writer.values(value for extent in memory.extents.starts.items() for value in extent)
+        writer.values(value for extent in memory.large_extents.starts.items() for value in extent)
+        writer.values(value for stack in memory.stacks for value in stack)
+        writer.values(value for chunk, (live, end) in memory.orphan_chunks.items() for value in (chunk, live, end))
+        writer.values([len(memory.regions)])
+        for region_id, region in memory.regions.items():
+            writer.values([region_id, region.bump, region.end,
+                           *(value for segment in region.segments for value in segment)])
+
+        handles = list(virtual_machine.thread_id_to_handle.values())
+        writer.values([len(handles)])
+        for handle in handles:
+            execution_unit = handle.execution_unit
+            heap = execution_unit.heap
+            heap._drain_remote_frees()
+            writer.values([execution_unit.threadID, execution_unit.stack_base, execution_unit.flags])
+            writer.signed([*execution_unit.registers, execution_unit.result])
+            writer.values([heap.bump, heap.bump_end,
+                           *(value for item in heap.live_blocks.items() for value in item)])
+            for free_list in heap.free_lists:
+                writer.values(free_list)
+
+    # 只保存有路径的普通文件, 标准输入/输出/错误在恢复时重新建立
+    files = []
+    for fd, file_handle in virtual_machine.fd_to_file_handle.items():
+        stream = file_handle.output_stream or file_handle.input_stream
+        if fd > 2 and stream is not None and not stream.closed:
+            files.append((fd, file_handle, stream.tell()))
+    writer.values([len(files)])
+    for fd, file_handle, position in files:
+        writer.values([fd, file_handle.flags, file_handle.mode, position])
+        writer.string(file_handle.path)
+
+    metadata = writer.buffer
+    temporary = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(temporary, "wb") as f:
+        f.write(_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, VirtualMachine.LVM_VERSION,
+                             memory.heap_page_size, virtual_machine.text_length, len(metadata), len(records) // 4))
+        f.write(metadata)
+        f.write(bytes(_align_page(_HEADER.size + len(metadata)) - _HEADER.size - len(metadata)))
+        for data in pages:
+            f.write(data)
+    os.replace(temporary, path)
+
+
+def read_snapshot(virtual_machine: VirtualMachine, path: str):
+    """从快照恢复虚拟机, 执行单元被重新创建但不启动"""
+    _check_stopped(virtual_machine)
+    with open(path, "rb") as f:
+        try:
+            mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            raise RuntimeError(f"Invalid snapshot: {path}")
+    view = memoryview(mapping)
+    try:
+        (magic, version, lvm_version, heap_page_size, text_length,
+         metadata_length, page_count) = _HEADER.unpack_from(view, 0)
+    except struct.error:
+        raise RuntimeError(f"Invalid snapshot: {path}")
+    if magic != SNAPSHOT_MAGIC:
+        raise RuntimeError(f"Invalid snapshot: {path}")
+    if version != SNAPSHOT_VERSION or lvm_version != VirtualMachine.LVM_VERSION:
+        raise RuntimeError(f"Unsupported snapshot version: {path}")
+
+    for handle in virtual_machine.thread_id_to_handle.values():
+        handle.execution_unit.destroy()
+    virtual_machine.thread_id_to_handle.clear()
+    for file_handle in virtual_machine.fd_to_file_handle.values():
+        file_handle.close()
+    virtual_machine.fd_to_file_handle.clear()
+    if virtual_machine.memory.heap_page_size != heap_page_size:
+        virtual_machine.memory = Memory(heap_page_size)
+    memory = virtual_machine.memory
+    memory.reset()
+
+    reader = SnapshotReader(view, _HEADER.size)
+    (virtual_machine.entry_point, virtual_machine.last_thread_id,
+     virtual_machine.last_fd, memory.last_region_id) = reader.values()
+    virtual_machine.text_length = text_length
+
+    with memory.lock:
+        records = reader.values()
+        offset = _align_page(_HEADER.size + metadata_length)
+        for index in range(page_count):
+            address, flags, ref_count, kind = records[index * 4:index * 4 + 4]
+            memory._set_memory_page(address, flags & _PERMISSIONS)
+            page = memory.page_for(address)
+            page.ref_count = ref_count
+            if kind == _PAGE_DATA:
+                page.share(view[offset:offset + page.size])
+                offset += page.size
+            elif kind == _PAGE_ZERO:
+                page.share(page._arena.zero_page)
+            page.flags = (page.flags & (MemoryPageFlag.MP_PRESENT | MemoryPageFlag.MP_COW)) | (flags & _PERMISSIONS)
+
+        for free_list in memory.small_free_lists:
+            free_list.extend(reader.values())
+        for extents in (memory.extents, memory.large_extents):
+            for start, end in _pairs(reader.values()):
+                extents.insert(start, end)
+        stacks = reader.values()
+        memory.stacks = [tuple(stacks[index:index + 3]) for index in range(0, len(stacks), 3)]
+        orphans = reader.values()
+        memory.orphan_chunks = {orphans[index]: [orphans[index + 1], orphans[index + 2]]
+                                for index in range(0, len(orphans), 3)}
+        for _ in range(reader.values()[0]):
+            region_id, bump, end, *segments = reader.values()
+            region = MemoryRegion(memory)
+            region.bump = bump
+            region.end = end
+            region.segments = _pairs(segments)
+            memory.regions[region_id] = region
+
+        for _ in range(reader.values()[0]):
+            execution_unit = ExecutionUnit(virtual_machine)
+            execution_unit.threadID, execution_unit.stack_base, execution_unit.flags = reader.values()
+            *registers, execution_unit.result = reader.signed()
+            execution_unit.registers[:len(registers)] = registers
+            heap = execution_unit.heap
+            heap.bump, heap.bump_end, *live_blocks = reader.values()
+            heap.live_blocks = dict(_pairs(live_blocks))
+            for chunk in heap.live_blocks:
+                memory.arena_chunks[chunk] = heap
+            for free_list in heap.free_lists:
+                free_list.extend(reader.values())
+            virtual_machine.thread_id_to_handle[execution_unit.threadID] = ThreadHandle(execution_unit)
+
+    virtual_machine._init_standard_streams()
+    for _ in range(reader.values()[0]):
+        fd, flags, mode, position = reader.values()
+        file_path = reader.string()
+        try:
+            # 写模式重新打开时不能截断文件
+            stream = open(file_path, "r+b" if flags & FileHandle.FH_WRITE else "rb")
+        except OSError:
+            continue
+        stream.seek(position)
+        virtual_machine.fd_to_file_handle[fd] = FileHandle(
+            file_path, flags, mode,
+            stream if flags & FileHandle.FH_READ else None,
+            stream if flags & FileHandle.FH_WRITE else None
+        )
+
+    cache = memory.instruction_cache
+    cache.predecode(0, text_length)
+    if virtual_machine.fusion:
+        virtual_machine.fusion_counts = cache.fuse(0, text_length)
+    if virtual_machine.dispatch == VirtualMachine.DISPATCH_AOT:
+        from ldk.l.lvm.aot import compile_module
+        from ldk.l.lvm.module import Module
+        text = memory.read_bytes(0, text_length)
+        module = Module(text, b"", b"", 0, virtual_machine.entry_point)
+        virtual_machine.aot_blocks = compile_module(module, virtual_machine.aot_cache_dir).BLOCKS
+        virtual_machine.aot_generation = cache.generation
@@ -1,11 +1,18 @@
+import bisect
+import collections
+import functools
+import hashlib
+import math
 import struct
 import sys
 import threading
+import weakref
 from enum import IntFlag
 from typing import Optional
 
 from hairinne.utils.Incomplete import incompleted
-from ldk.l.lvm.module import Module
+from ldk.l.lvm.codecache import CodeCache, DEFAULT_CODE_CACHE_SIZE
+from ldk.l.lvm.module import Module, Section, TEXT_SECTION
 
 
 class ByteCode:
@@ -156,6 +163,17 @@ class ByteCode:
     CREATE_THREAD = 0x79
     THREAD_CONTROL = 0x7a
 
+    # 块内存操作指令 (模块版本 1)
+    MEMCPY = 0x7b
+    MEMSET = 0x7c
+    MEMCMP = 0x7d
+    STRLEN = 0x7e
+
+    # 区域分配指令 (模块版本 2)
+    REGION_CREATE = 0x7f
+    REGION_ALLOC = 0x80
+    REGION_DESTROY = 0x81
+
     instruction_names = {
         NOP: "NOP",
         PUSH_1: "PUSH_1",
@@ -279,7 +297,148 @@ class ByteCode:
         GET_LOCAL_ADDRESS: "GET_LOCAL_ADDRESS",
         GET_PARAMETER_ADDRESS: "GET_PARAMETER_ADDRESS",
         CREATE_THREAD: "CREATE_THREAD",
-        THREAD_CONTROL: "THREAD_CONTROL"
+        THREAD_CONTROL: "THREAD_CONTROL",
+        MEMCPY: "MEMCPY",
+        MEMSET: "MEMSET",
+        MEMCMP: "MEMCMP",
+        STRLEN: "STRLEN",
+        REGION_CREATE: "REGION_CREATE",
+        REGION_ALLOC: "REGION_ALLOC",
+        REGION_DESTROY: "REGION_DESTROY"
+    }
+
+    # 操作数格式: 每个操作数的字节数 (立即数按小端序无符号解码)
+    instruction_operands = {
+        NOP: (),
+        PUSH_1: (1,),
+        PUSH_2: (1,),
+        PUSH_4: (1,),
+        PUSH_8: (1,),
+        POP_1: (1,),
+        POP_2: (1,),
+        POP_4: (1,),
+        POP_8: (1,),
+        LOAD_1: (1, 1),
+        LOAD_2: (1, 1),
+        LOAD_4: (1, 1),
+        LOAD_8: (1, 1),
+        STORE_1: (1, 1),
+        STORE_2: (1, 1),
+        STORE_4: (1, 1),
+        STORE_8: (1, 1),
+        CMP: (1, 1, 1),
+        ATOMIC_CMP: (1, 1, 1),
+        MOV_E: (1, 1),
+        MOV_NE: (1, 1),
+        MOV_L: (1, 1),
+        MOV_LE: (1, 1),
+        MOV_G: (1, 1),
+        MOV_GE: (1, 1),
+        MOV_UL: (1, 1),
+        MOV_ULE: (1, 1),
+        MOV_UG: (1, 1),
+        MOV_UGE: (1, 1),
+        MOV: (1, 1),
+        MOV_IMMEDIATE1: (1, 1),
+        MOV_IMMEDIATE2: (2, 1),
+        MOV_IMMEDIATE4: (4, 1),
+        MOV_IMMEDIATE8: (8, 1),
+        JUMP: (1,),
+        JUMP_IMMEDIATE: (8,),
+        JE: (1,),
+        JNE: (1,),
+        JL: (1,),
+        JLE: (1,),
+        JG: (1,),
+        JGE: (1,),
+        JUL: (1,),
+        JULE: (1,),
+        JUG: (1,),
+        JUGE: (1,),
+        MALLOC: (1, 1),
+        FREE: (1,),
+        REALLOC: (1, 1, 1),
+        ADD: (1, 1, 1),
+        SUB: (1, 1, 1),
+        MUL: (1, 1, 1),
+        DIV: (1, 1, 1),
+        MOD: (1, 1, 1),
+        AND: (1, 1, 1),
+        OR: (1, 1, 1),
+        XOR: (1, 1, 1),
+        NOT: (1, 1),
+        NEG: (1, 1),
+        SHL: (1, 1, 1),
+        SHR: (1, 1, 1),
+        USHR: (1, 1, 1),
+        INC: (1,),
+        DEC: (1,),
+        ADD_DOUBLE: (1, 1, 1),
+        SUB_DOUBLE: (1, 1, 1),
+        MUL_DOUBLE: (1, 1, 1),
+        DIV_DOUBLE: (1, 1, 1),
+        MOD_DOUBLE: (1, 1, 1),
+        ADD_FLOAT: (1, 1, 1),
+        SUB_FLOAT: (1, 1, 1),
+        MUL_FLOAT: (1, 1, 1),
+        DIV_FLOAT: (1, 1, 1),
+        MOD_FLOAT: (1, 1, 1),
+        ATOMIC_ADD: (1, 1, 1),
+        ATOMIC_SUB: (1, 1, 1),
+        ATOMIC_MUL: (1, 1, 1),
+        ATOMIC_DIV: (1, 1, 1),
+        ATOMIC_MOD: (1, 1, 1),
+        ATOMIC_AND: (1, 1, 1),
+        ATOMIC_OR: (1, 1, 1),
+        ATOMIC_XOR: (1, 1, 1),
+        ATOMIC_NOT: (1, 1),
+        ATOMIC_NEG: (1, 1),
+        ATOMIC_SHL: (1, 1, 1),
+        ATOMIC_SHR: (1, 1, 1),
+        ATOMIC_USHR: (1, 1, 1),
+        ATOMIC_INC: (1,),
+        ATOMIC_DEC: (1,),
+        ATOMIC_ADD_DOUBLE: (1, 1, 1),
+        ATOMIC_SUB_DOUBLE: (1, 1, 1),
+        ATOMIC_MUL_DOUBLE: (1, 1, 1),
+        ATOMIC_DIV_DOUBLE: (1, 1, 1),
+        ATOMIC_MOD_DOUBLE: (1, 1, 1),
+        ATOMIC_ADD_FLOAT: (1, 1, 1),
+        ATOMIC_SUB_FLOAT: (1, 1, 1),
+        ATOMIC_MUL_FLOAT: (1, 1, 1),
+        ATOMIC_DIV_FLOAT: (1, 1, 1),
+        ATOMIC_MOD_FLOAT: (1, 1, 1),
+        CAS: (1, 1, 1),
+        INVOKE: (1,),
+        INVOKE_IMMEDIATE: (8,),
+        RETURN: (),
+        GET_RESULT: (1,),
+        SET_RESULT: (1,),
+        TYPE_CAST: (1, 1, 1),
+        LONG_TO_DOUBLE: (1, 1),
+        DOUBLE_TO_LONG: (1, 1),
+        DOUBLE_TO_FLOAT: (1, 1),
+        FLOAT_TO_DOUBLE: (1, 1),
+        OPEN: (1, 1, 1, 1),
+        CLOSE: (1, 1),
+        READ: (1, 1, 1, 1),
+        WRITE: (1, 1, 1, 1),
+        CREATE_FRAME: (8,),
+        DESTROY_FRAME: (8,),
+        EXIT: (1,),
+        EXIT_IMMEDIATE: (8,),
+        GET_FIELD_ADDRESS: (1, 8, 1),
+        GET_LOCAL_ADDRESS: (8, 1),
+        GET_PARAMETER_ADDRESS: (8, 1),
+        CREATE_THREAD: (8, 1),
+        THREAD_CONTROL: (1, 1, 1, 1),
+        MEMCPY: (1, 1, 1),
+        MEMSET: (1, 1, 1),
+        MEMCMP: (1, 1, 1, 1),
+        STRLEN: (1, 1),
+        REGION_CREATE: (1,),
+        REGION_ALLOC: (1, 1, 1),
+        REGION_DESTROY: (1,)
     }
 
     @staticmethod
@@ -314,6 +473,23 @@ class ByteCode:
         return ByteCode.ADD <= code <= ByteCode.DEC
 
 
+class SuperInstruction:
+    """加载期融合得到的超级指令, 编号位于单字节指令码之后, 只存在于指令缓存中"""
+    CMP_JUMP = 0x100  # CMP + JE..JUGE
+    MOV_IMMEDIATE_ADD = 0x101  # MOV_IMMEDIATE* + ADD
+    MOV_IMMEDIATE_SUB = 0x102  # MOV_IMMEDIATE* + SUB
+    PUSH_RUN = 0x103  # 连续的 PUSH_*
+    POP_RUN = 0x104  # 连续的 POP_*
+
+    instruction_names = {
+        CMP_JUMP: "CMP_JUMP",
+        MOV_IMMEDIATE_ADD: "MOV_IMMEDIATE_ADD",
+        MOV_IMMEDIATE_SUB: "MOV_IMMEDIATE_SUB",
+        PUSH_RUN: "PUSH_RUN",
+        POP_RUN: "POP_RUN"
+    }
+
+
 class FileHandle:
     FH_READ = 1
     FH_WRITE = 1 << 1
@@ -367,113 +543,313 @@ class FileHandle:
             raise RuntimeError(e)
 
 
+class StackOverflowError(RuntimeError):
+    """栈溢出: 访问了线程栈下方的守护页"""
+
+
 class MemoryPageFlag(IntFlag):
     MP_READ = 1
     MP_WRITE = 1 << 1
     MP_EXEC = 1 << 2
     MP_PRESENT = 1 << 3
+    MP_COW = 1 << 4  # 页数据为共享的只读缓冲区, 首次写入时复制
+
+
+_SHORT = struct.Struct('<h')
+_INT = struct.Struct('<i')
+_LONG = struct.Struct('<q')
+_FLOAT = struct.Struct('<f')
+_DOUBLE = struct.Struct('<d')
+_USHORT = struct.Struct('<H')
+_UINT = struct.Struct('<I')
+_ULONG = struct.Struct('<Q')
+
+
+class PageArena:
+    """
+      内存页数据的共享分配区
+
+      按块预分配大bytearray, 以memoryview切片的形式分给内存页; 页销毁后其槽位清零并回收复用,
+      不再交还Python的内存分配器. 每个分配区只提供一种页大小
+    """
+    CHUNK_SIZE = 1 << 20
+
+    def __init__(self, page_size: int = 4096, chunk_size: int = CHUNK_SIZE):
+        self.page_size = page_size
+        self.chunk_pages = max(1, chunk_size // page_size)
+        # 共享的只读零页
+        self.zero_page = memoryview(bytes(page_size))
+        self.chunks: list[bytearray] = []
+        self.free_slots: list[memoryview] = []
+        self.lock = threading.RLock()
+
+    def allocate(self) -> memoryview:
+        with self.lock:
+            if not self.free_slots:
+                self._grow()
+            return self.free_slots.pop()
+
+    def release(self, slot: memoryview):
+        slot[:] = self.zero_page
+        with self.lock:
+            self.free_slots.append(slot)
+
+    def _grow(self):
+        chunk = bytearray(self.chunk_pages * self.page_size)
+        self.chunks.append(chunk)
+        view = memoryview(chunk)
+        # 倒序放入, 使页按地址递增的顺序分出
+        for index in range(self.chunk_pages - 1, -1, -1):
+            start = index * self.page_size
+            self.free_slots.append(view[start:start + self.page_size])
 
 
 class MemoryPage:
+    """
+      内存页, 默认4KiB; 大小由其所属的PageArena决定
+
+      页数据是PageArena中的memoryview切片, 权限以整数保存. 从未写入的页在首次读取时
+      指向共享的只读零页并带有MP_COW标志, 首次写入时才复制出私有缓冲区.
+      readable/writable/executable 仅在页已分配物理内存且有对应权限时为True (有MP_COW时writable为False),
+      读写时先检查这些布尔值, 常见情况下不加锁; 否则进入加锁的 _check_access 慢路径.
+      延迟初始化、修改权限与销毁都在分配区的锁内进行并刷新这些布尔值.
+      decoded 在指令缓存首次保存本页上的指令时置为True, 此后对本页的写入都要使缓存失效,
+      无论本页是否有MP_EXEC权限
+    """
     PAGE_SIZE = 4096
+    PAGE_SHIFT = 12
+    PAGE_OFFSET_MASK = PAGE_SIZE - 1
 
-    def __init__(self, flags: MemoryPageFlag):
-        self.flags = flags
+    __slots__ = ('ref_count', 'data', 'size', 'offset_mask', 'readable', 'writable', 'executable',
+                 'decoded', '_flags', '_arena', '_loader')
+
+    def __init__(self, flags: int, arena: PageArena):
         self.ref_count = 0
-        self._data = None
-        self._lock = threading.RLock()
+        self.size = arena.page_size
+        self.offset_mask = arena.page_size - 1
+        self.data: Optional[memoryview] = None
+        self.readable = False
+        self.writable = False
+        self.executable = False
+        self.decoded = False
+        self._arena = arena
+        # 首次访问时提供页内容的回调, 见 defer
+        self._loader = None
+        self.flags = flags
+
+    @property
+    def flags(self) -> int:
+        return self._flags
+
+    @flags.setter
+    def flags(self, flags: int):
+        with self._arena.lock:
+            self._flags = flags = int(flags)
+            present = bool(flags & MemoryPageFlag.MP_PRESENT)
+            self.readable = present and bool(flags & MemoryPageFlag.MP_READ)
+            self.writable = (present and bool(flags & MemoryPageFlag.MP_WRITE) and
+                             not flags & MemoryPageFlag.MP_COW)
+            self.executable = present and bool(flags & MemoryPageFlag.MP_EXEC)
 
     def initialize(self):
         """延迟初始化内存页"""
-        with self._lock:
-            if self.flags & MemoryPageFlag.MP_PRESENT:
+        with self._arena.lock:
+            if self._flags & MemoryPageFlag.MP_PRESENT:
                 return
 
-            self._data = bytearray(MemoryPage.PAGE_SIZE)
-            self.flags |= MemoryPageFlag.MP_PRESENT
+            self.data = self._arena.allocate()
+            self.flags = self._flags | MemoryPageFlag.MP_PRESENT
+
+    def share(self, data: memoryview):
+        """以共享的只读缓冲区作为页数据, 写入前需 copy_on_write"""
+        with self._arena.lock:
+            if self._flags & MemoryPageFlag.MP_PRESENT:
+                return
+
+            self.data = data
+            self.flags = self._flags | MemoryPageFlag.MP_PRESENT | MemoryPageFlag.MP_COW
+
+    def defer(self, loader):
+        """
+          页内容在首次访问时由 loader() 提供 (如按页解压), 之前不占用物理内存;
+          loader(record=False) 只返回内容而不视为首次访问, 见 peek
+        """
+        with self._arena.lock:
+            if not self._flags & MemoryPageFlag.MP_PRESENT:
+                self._loader = loader
+
+    def _load(self):
+        content = self._loader()
+        self._loader = None
+        if len(content) < self.size:
+            content = bytes(content) + bytes(self.size - len(content))
+        # 共享页库中的页须原样引用, 库以该缓冲区对象的存活判断内容是否仍在使用
+        self.share(content if isinstance(content, memoryview) else memoryview(content))
+
+    def peek(self):
+        """返回延迟加载页的内容而不装入本页, 页仍保持未加载状态"""
+        content = self._loader(record=False)
+        if len(content) < self.size:
+            content = bytes(content) + bytes(self.size - len(content))
+        return content
+
+    def copy_on_write(self):
+        with self._arena.lock:
+            if not self._flags & MemoryPageFlag.MP_COW:
+                return
+
+            slot = self._arena.allocate()
+            slot[:] = self.data
+            self.data = slot
+            self.flags = self._flags & ~MemoryPageFlag.MP_COW
 
     def retain(self):
-        with self._lock:
+        with self._arena.lock:
             self.ref_count += 1
 
     def release(self):
-        with self._lock:
+        with self._arena.lock:
             self.ref_count -= 1
             if self.ref_count == 0:
                 self.destroy()
 
     def destroy(self):
-        with self._lock:
-            self._data = None
-            self.flags &= ~MemoryPageFlag.MP_PRESENT
+        with self._arena.lock:
+            self._loader = None
+            if not self._flags & MemoryPageFlag.MP_PRESENT:
+                return
+            # 先关闭快速路径再回收缓冲区, 共享缓冲区不属于本页
+            shared = self._flags & MemoryPageFlag.MP_COW
+            self.flags = self._flags & ~(MemoryPageFlag.MP_PRESENT | MemoryPageFlag.MP_COW)
+            if not shared:
+                self._arena.release(self.data)
+            self.data = None
 
     # 内存读取方法
     def get_byte(self, offset: int) -> int:
-        self._check_access(offset, MemoryPageFlag.MP_READ, 1)
-        return self._data[offset]
+        if not self.readable or not 0 <= offset < self.size:
+            self._check_access(offset, MemoryPageFlag.MP_READ, 1)
+        return self.data[offset]
 
     def get_short(self, offset: int) -> int:
-        self._check_access(offset, MemoryPageFlag.MP_READ, 2)
-        return struct.unpack('<h', self._data[offset:offset + 2])[0]
+        if not self.readable or not 0 <= offset <= self.size - 2:
+            self._check_access(offset, MemoryPageFlag.MP_READ, 2)
+        return _SHORT.unpack_from(self.data, offset)[0]
 
     def get_int(self, offset: int) -> int:
-        self._check_access(offset, MemoryPageFlag.MP_READ, 4)
-        return struct.unpack('<i', self._data[offset:offset + 4])[0]
+        if not self.readable or not 0 <= offset <= self.size - 4:
+            self._check_access(offset, MemoryPageFlag.MP_READ, 4)
+        return _INT.unpack_from(self.data, offset)[0]
 
     def get_long(self, offset: int) -> int:
-        self._check_access(offset, MemoryPageFlag.MP_READ, 8)
-        return struct.unpack('<q', self._data[offset:offset + 8])[0]
+        if not self.readable or not 0 <= offset <= self.size - 8:
+            self._check_access(offset, MemoryPageFlag.MP_READ, 8)
+        return _LONG.unpack_from(self.data, offset)[0]
 
     def get_float(self, offset: int) -> float:
-        self._check_access(offset, MemoryPageFlag.MP_READ, 4)
-        return struct.unpack('<f', self._data[offset:offset + 4])[0]
+        if not self.readable or not 0 <= offset <= self.size - 4:
+            self._check_access(offset, MemoryPageFlag.MP_READ, 4)
+        return _FLOAT.unpack_from(self.data, offset)[0]
 
     def get_double(self, offset: int) -> float:
-        self._check_access(offset, MemoryPageFlag.MP_READ, 8)
-        return struct.unpack('<d', self._data[offset:offset + 8])[0]
+        if not self.readable or not 0 <= offset <= self.size - 8:
+            self._check_access(offset, MemoryPageFlag.MP_READ, 8)
+        return _DOUBLE.unpack_from(self.data, offset)[0]
 
     # 内存写入方法
     def set_byte(self, offset: int, value: int):
-        self._check_access(offset, MemoryPageFlag.MP_WRITE, 1)
-        self._data[offset] = value & 0xFF
+        if not self.writable or not 0 <= offset < self.size:
+            self._check_access(offset, MemoryPageFlag.MP_WRITE, 1)
+        self.data[offset] = value & 0xFF
 
     def set_short(self, offset: int, value: int):
-        self._check_access(offset, MemoryPageFlag.MP_WRITE, 2)
-        self._data[offset:offset + 2] = struct.pack('<h', value)
+        if not self.writable or not 0 <= offset <= self.size - 2:
+            self._check_access(offset, MemoryPageFlag.MP_WRITE, 2)
+        _SHORT.pack_into(self.data, offset, value)
 
     def set_int(self, offset: int, value: int):
-        self._check_access(offset, MemoryPageFlag.MP_WRITE, 4)
-        self._data[offset:offset + 4] = struct.pack('<i', value)
+        if not self.writable or not 0 <= offset <= self.size - 4:
+            self._check_access(offset, MemoryPageFlag.MP_WRITE, 4)
+        _INT.pack_into(self.data, offset, value)
 
     def set_long(self, offset: int, value: int):
-        self._check_access(offset, MemoryPageFlag.MP_WRITE, 8)
-        self._data[offset:offset + 8] = struct.pack('<q', value)
+        if not self.writable or not 0 <= offset <= self.size - 8:
+            self._check_access(offset, MemoryPageFlag.MP_WRITE, 8)
+        _LONG.pack_into(self.data, offset, value)
 
     def set_float(self, offset: int, value: float):
-        self._check_access(offset, MemoryPageFlag.MP_WRITE, 4)
-        self._data[offset:offset + 4] = struct.pack('<f', value)
+        if not self.writable or not 0 <= offset <= self.size - 4:
+            self._check_access(offset, MemoryPageFlag.MP_WRITE, 4)
+        _FLOAT.pack_into(self.data, offset, value)
 
     def set_double(self, offset: int, value: float):
-        self._check_access(offset, MemoryPageFlag.MP_WRITE, 8)
-        self._data[offset:offset + 8] = struct.pack('<d', value)
+        if not self.writable or not 0 <= offset <= self.size - 8:
+            self._check_access(offset, MemoryPageFlag.MP_WRITE, 8)
+        _DOUBLE.pack_into(self.data, offset, value)
 
     # 辅助方法
     def _check_access(self, offset: int, flag: MemoryPageFlag, size: int):
-        """检查内存访问权限和边界"""
-        with self._lock:
-            # 确保页已初始化
-            if not (self.flags & MemoryPageFlag.MP_PRESENT):
-                self.initialize()
+        """慢路径: 检查内存访问权限和边界"""
+        with self._arena.lock:
+            # 确保页已初始化: 延迟加载的页取回其内容, 否则读访问映射共享零页, 写访问分配私有缓冲区
+            if not (self._flags & MemoryPageFlag.MP_PRESENT):
+                if self._loader is not None:
+                    self._load()
+                elif flag == MemoryPageFlag.MP_WRITE:
+                    self.initialize()
+                else:
+                    self.share(self._arena.zero_page)
 
             # 检查访问权限
-            if not (self.flags & flag):
+            if not (self._flags & flag):
                 raise RuntimeError(f"Page does not have {flag.name} permission")
 
+            if flag == MemoryPageFlag.MP_WRITE and self._flags & MemoryPageFlag.MP_COW:
+                self.copy_on_write()
+
             # 检查边界
-            if offset < 0 or offset + size > MemoryPage.PAGE_SIZE:
+            if offset < 0 or offset + size > self.size:
                 raise RuntimeError(f"Invalid offset {offset} for {size}-byte access")
 
 
+class SharedPageStore:
+    """
+      进程内共享的只读页内容库, 以页内容的SHA-256为键
+
+      同一进程中多个 Memory 装入相同的模块时, 内容相同的text/rodata页只保存一份,
+      各页以MP_COW方式引用, 写入时照常复制出私有缓冲区. 库中只保存弱引用, 引用计数即缓冲区对象
+      的引用计数: 最后一个引用某内容的页被销毁或写时复制后, 该内容自动移出库
+    """
+
+    def __init__(self):
+        self.pages: weakref.WeakValueDictionary[bytes, memoryview] = weakref.WeakValueDictionary()
+        self.stats = {"hits": 0, "misses": 0}
+        self.lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.pages)
+
+    def intern(self, content) -> memoryview:
+        """返回与 content 内容相同的共享只读页, 不足一页时以0补齐"""
+        if len(content) < MemoryPage.PAGE_SIZE:
+            content = bytes(content) + bytes(MemoryPage.PAGE_SIZE - len(content))
+        key = hashlib.sha256(content).digest()
+        with self.lock:
+            data = self.pages.get(key)
+            if data is not None:
+                self.stats["hits"] += 1
+                return data
+            self.stats["misses"] += 1
+            data = memoryview(content).cast('B')
+            if not data.readonly:
+                data = memoryview(bytes(data))
+            self.pages[key] = data
+            return data
+
+
+SHARED_PAGES = SharedPageStore()
+
+
 class MemoryPageFreeMemory:
     __slots__ = ('start', 'end', 'next')
 
@@ -483,250 +859,1105 @@ class MemoryPageFreeMemory:
         self.next: Optional[MemoryPageFreeMemory] = None
 
 
-class Memory:
-    MAX_MEMORY_ADDRESS = 0x0000ffffffffffff
-    PAGE_TABLE_SIZE = 512
-    PAGE_SIZE = MemoryPage.PAGE_SIZE
-    PAGE_OFFSET_MASK = MemoryPage.PAGE_OFFSET_MASK
+class MemoryAccessor:
+    """按虚拟地址读写内存, 子类提供地址转换 page_for 与 instruction_cache; 页内偏移按各页自身的大小计算"""
+
+    def page_for(self, address: int) -> MemoryPage:
+        raise NotImplementedError
+
+    # 内存读写方法
+    # 整数按宽度零扩展读取、截断写入; 访问落在单页内时只做一次地址转换, 跨页时逐字节处理
+    def get_byte(self, address: int) -> int:
+        page = self.page_for(address)
+        return page.get_byte(address & page.offset_mask)
+
+    def get_short(self, address: int) -> int:
+        return self._unpack(address, _USHORT)
 
-    class FreeMemory:
-        __slots__ = ('start', 'end', 'next')
+    def get_int(self, address: int) -> int:
+        return self._unpack(address, _UINT)
 
-        def __init__(self, start: int, end: int):
-            self.start = start
-            self.end = end
-            self.next = None
+    def get_long(self, address: int) -> int:
+        return self._unpack(address, _ULONG)
+
+    def get_float(self, address: int) -> float:
+        return self._unpack(address, _FLOAT)
+
+    def get_double(self, address: int) -> float:
+        return self._unpack(address, _DOUBLE)
+
+    def set_byte(self, address: int, value: int):
+        page = self.page_for(address)
+        page.set_byte(address & page.offset_mask, value)
+        if page.decoded:
+            self.instruction_cache.invalidate(address)
+
+    def set_short(self, address: int, value: int):
+        self._pack(address, _USHORT, value & 0xFFFF)
+
+    def set_int(self, address: int, value: int):
+        self._pack(address, _UINT, value & 0xFFFFFFFF)
+
+    def set_long(self, address: int, value: int):
+        self._pack(address, _ULONG, value & 0xFFFFFFFFFFFFFFFF)
+
+    def set_float(self, address: int, value: float):
+        self._pack(address, _FLOAT, value)
+
+    def set_double(self, address: int, value: float):
+        self._pack(address, _DOUBLE, value)
+
+    # 批量操作, 按页分块并以切片赋值完成
+    def read_bytes(self, address: int, length: int) -> bytes:
+        buffer = bytearray(length)
+        for page, offset, size, position in self._chunks(address, length, MemoryPageFlag.MP_READ):
+            buffer[position:position + size] = page.data[offset:offset + size]
+        return bytes(buffer)
+
+    def write_bytes(self, address: int, data):
+        view = memoryview(data).cast('B')
+        for page, offset, size, position in self._chunks(address, len(view), MemoryPageFlag.MP_WRITE):
+            page.data[offset:offset + size] = view[position:position + size]
+            if page.decoded:
+                self.instruction_cache.invalidate(address + position, size)
+
+    def fill(self, address: int, value: int, length: int):
+        pattern = b""
+        for page, offset, size, position in self._chunks(address, length, MemoryPageFlag.MP_WRITE):
+            if len(pattern) < size:
+                pattern = bytes([value & 0xFF]) * size
+            page.data[offset:offset + size] = pattern[:size]
+            if page.decoded:
+                self.instruction_cache.invalidate(address + position, size)
+
+    def copy_within(self, destination: int, source: int, length: int):
+        """
+          复制 [source, source + length) 到 destination, 允许两段重叠;
+          每次复制两侧都不跨页的一段, 目标在源之后且重叠时从末尾向前复制
+        """
+        backward = source < destination < source + length
+        position = length if backward else 0
+        while (position > 0) if backward else (position < length):
+            if backward:
+                # 以各自末字节所在的页确定这一段
+                source_page = self.page_for(source + position - 1)
+                destination_page = self.page_for(destination + position - 1)
+                size = min(position, ((source + position - 1) & source_page.offset_mask) + 1,
+                           ((destination + position - 1) & destination_page.offset_mask) + 1)
+                position -= size
+                start = position
+            else:
+                source_page = self.page_for(source + position)
+                destination_page = self.page_for(destination + position)
+                size = min(length - position,
+                           source_page.size - ((source + position) & source_page.offset_mask),
+                           destination_page.size - ((destination + position) & destination_page.offset_mask))
+                start = position
+                position += size
+            source_offset = (source + start) & source_page.offset_mask
+            destination_offset = (destination + start) & destination_page.offset_mask
+            if not source_page.readable:
+                source_page._check_access(source_offset, MemoryPageFlag.MP_READ, size)
+            if not destination_page.writable:
+                destination_page._check_access(destination_offset, MemoryPageFlag.MP_WRITE, size)
+            chunk = source_page.data[source_offset:source_offset + size]
+            if source_page is destination_page:
+                # 同一页内的两段可能重叠
+                chunk = chunk.tobytes()
+            destination_page.data[destination_offset:destination_offset + size] = chunk
+            if destination_page.decoded:
+                self.instruction_cache.invalidate(destination + start, size)
+
+    def find_byte(self, address: int, value: int, limit: int = -1) -> int:
+        """
+          从address开始查找第一个等于value的字节, 返回其地址; limit为非负数时最多查找limit个字节,
+          未找到时返回-1
+        """
+        needle = bytes([value & 0xFF])
+        while limit != 0:
+            page = self.page_for(address)
+            offset = address & page.offset_mask
+            size = page.size - offset
+            if 0 <= limit < size:
+                size = limit
+            if not page.readable:
+                page._check_access(offset, MemoryPageFlag.MP_READ, size)
+            index = page.data[offset:offset + size].tobytes().find(needle)
+            if index >= 0:
+                return address + index
+            address += size
+            if limit > 0:
+                limit -= size
+        return -1
+
+    def compare(self, first: int, second: int, length: int) -> int:
+        """按无符号字节比较两段内存, 返回 -1/0/1"""
+        position = 0
+        while position < length:
+            size = min(length - position, MemoryPage.PAGE_SIZE)
+            a = self.read_bytes(first + position, size)
+            b = self.read_bytes(second + position, size)
+            if a != b:
+                return -1 if a < b else 1
+            position += size
+        return 0
+
+    def read_string(self, address: int) -> bytes:
+        """读取以NUL结尾的字符串, 不含结尾的NUL"""
+        return self.read_bytes(address, self.find_byte(address, 0) - address)
+
+    def _chunks(self, address: int, length: int, flag: MemoryPageFlag):
+        """把 [address, address + length) 切分为页内片段, 依次产生 (页, 页内偏移, 长度, 片段在区间中的位置)"""
+        position = 0
+        while position < length:
+            page = self.page_for(address)
+            offset = address & page.offset_mask
+            size = min(length - position, page.size - offset)
+            if not (page.writable if flag == MemoryPageFlag.MP_WRITE else page.readable):
+                page._check_access(offset, flag, size)
+            yield page, offset, size, position
+            address += size
+            position += size
+
+    def _unpack(self, address: int, layout: struct.Struct):
+        page = self.page_for(address)
+        offset = address & page.offset_mask
+        if offset + layout.size > page.size:
+            # 跨页访问
+            return layout.unpack(self.read_bytes(address, layout.size))[0]
+        if not page.readable:
+            page._check_access(offset, MemoryPageFlag.MP_READ, layout.size)
+        return layout.unpack_from(page.data, offset)[0]
+
+    def _pack(self, address: int, layout: struct.Struct, value):
+        page = self.page_for(address)
+        offset = address & page.offset_mask
+        if offset + layout.size > page.size:
+            # 跨页访问
+            self.write_bytes(address, layout.pack(value))
+            return
+        if not page.writable:
+            page._check_access(offset, MemoryPageFlag.MP_WRITE, layout.size)
+        layout.pack_into(page.data, offset, value)
+        if page.decoded:
+            self.instruction_cache.invalidate(address, layout.size)
+
+
+class FreeExtents:
+    """空闲地址区间: 以 (长度, 起始地址) 有序表做最佳适配, 并按起止地址索引以便O(1)合并相邻区间"""
 
     def __init__(self):
-        self.memory_page_table: dict[int, dict[int, dict[int, dict[int, MemoryPage]]]] = {}
-        self.free_memory_list: Optional[Memory.FreeMemory] = None
+        self.starts: dict[int, int] = {}
+        self.ends: dict[int, int] = {}
+        self.sizes: list[tuple[int, int]] = []
+
+    def take(self, length: int) -> int:
+        """最佳适配: 取出长度不小于length的最小空闲区间, 余下部分放回"""
+        index = bisect.bisect_left(self.sizes, (length, -1))
+        if index == len(self.sizes):
+            raise RuntimeError("Out of memory")
+        start = self.sizes[index][1]
+        end = self.starts[start]
+        self.remove(start, end)
+        if end > start + length:
+            self.insert(start + length, end)
+        return start
+
+    def take_aligned(self, length: int, alignment: int) -> int:
+        """取出起始地址按alignment对齐的区间, 对齐前后的剩余部分放回"""
+        index = bisect.bisect_left(self.sizes, (length, -1))
+        for size, start in self.sizes[index:]:
+            aligned = (start + alignment - 1) & -alignment
+            end = start + size
+            if aligned + length <= end:
+                self.remove(start, end)
+                if aligned > start:
+                    self.insert(start, aligned)
+                if end > aligned + length:
+                    self.insert(aligned + length, end)
+                return aligned
+        raise RuntimeError("Out of memory")
+
+    def insert(self, start: int, end: int):
+        """加入空闲区间并与前后相邻的空闲区间合并"""
+        previous = self.ends.get(start)
+        if previous is not None:
+            self.remove(previous, start)
+            start = previous
+        following = self.starts.get(end)
+        if following is not None:
+            self.remove(end, following)
+            end = following
+        self.starts[start] = end
+        self.ends[end] = start
+        bisect.insort(self.sizes, (end - start, start))
+
+    def remove(self, start: int, end: int):
+        del self.starts[start]
+        del self.ends[end]
+        index = bisect.bisect_left(self.sizes, (end - start, start))
+        del self.sizes[index]
+
+
+class Memory(MemoryAccessor):
+    MAX_MEMORY_ADDRESS = 0x0000ffffffffffff
+    PAGE_SIZE = MemoryPage.PAGE_SIZE
+    # 启用大页时, 大块与区域从此地址开始的堆区分配
+    LARGE_PAGE_BASE = 1 << 40
+
+    # 分配器: 块以8字节头部 (可用字节数) 开始, 总长按16字节对齐.
+    # 总长不超过 SMALL_BLOCK_LIMIT 的小块按大小分级放入各自的空闲栈, 释放后不合并;
+    # 其余块从空闲区间 (FreeExtents) 中最佳适配
+    BLOCK_HEADER_SIZE = 8
+    BLOCK_ALIGNMENT = 16
+    SMALL_BLOCK_LIMIT = 1024
+
+    def __init__(self, heap_page_size: int = PAGE_SIZE):
+        """
+          heap_page_size: 大块与区域所用的页大小, 为2的幂且不小于4KiB.
+          大于4KiB时 [LARGE_PAGE_BASE, MAX_MEMORY_ADDRESS) 成为大页区, 其页表键为 ~(address >> large_page_shift);
+          模块映像、bss、线程栈与线程分配区仍在低地址的4KiB页上
+        """
+        if heap_page_size < MemoryPage.PAGE_SIZE or heap_page_size & (heap_page_size - 1):
+            raise ValueError(f"Heap page size must be a power of two no smaller than "
+                             f"{MemoryPage.PAGE_SIZE}: {heap_page_size}")
+        # 页号 -> 内存页
+        self.memory_page_table: dict[int, MemoryPage] = {}
+        self.arena = PageArena()
+        self.heap_page_size = heap_page_size
+        self.large_page_shift = heap_page_size.bit_length() - 1
+        if heap_page_size > MemoryPage.PAGE_SIZE:
+            self.large_page_base = self.LARGE_PAGE_BASE
+            self.large_arena = PageArena(heap_page_size, max(PageArena.CHUNK_SIZE, heap_page_size))
+        else:
+            self.large_page_base = self.MAX_MEMORY_ADDRESS + 1
+            self.large_arena = self.arena
+        self.small_free_lists: list[list[int]] = []
+        self.extents = FreeExtents()
+        self.large_extents = FreeExtents()
+        # 大块与区域使用的空闲区间
+        self.heap_extents = self.large_extents if self.large_page_base <= self.MAX_MEMORY_ADDRESS \
+            else self.extents
+        self.regions: dict[int, MemoryRegion] = {}
+        self.last_region_id = 0
+        # 线程栈的保留区间 (守护页起始, 栈底, 栈顶), 按起始地址排序
+        self.stacks: list[tuple[int, int, int]] = []
+        # 块号 (address >> AllocationArena.CHUNK_SHIFT) -> 拥有该块的线程分配区
+        self.arena_chunks: dict[int, AllocationArena] = {}
+        # 所属线程已结束但仍有存活小块的块: 块号 -> [存活小块数, 块内已切分部分的末尾]
+        self.orphan_chunks: dict[int, list[int]] = {}
+        # 只读的映像页放入此共享页库
+        self.page_store = SHARED_PAGES
+        self.instruction_cache = InstructionCache(self)
+        # 各执行单元的TLB, 页被移除时广播失效
+        self.translation_buffers: weakref.WeakSet[TranslationBuffer] = weakref.WeakSet()
         self.lock = threading.RLock()
 
-    def init(self, text: bytes, rodata: bytes, data: bytes, bss_section_length: int):
+    def init(self, sections: list[Section], bss_section_length: int, predecode_text: bool = True):
+        """
+          按模块的段装入映像并建立bss段与堆, 并预解码可执行段;
+          predecode_text 为False时不扫描text段, 由调用者在映射后自行预解码或载入 (如来自CodeCache的指令表)
+
+          与多个段共享的页取各段权限的并集, 映像末尾不含任何段内容的页按data段处理.
+          不可写的页 (text、rodata) 的内容放入进程内的共享页库 (page_store), 相同内容的页在各实例间
+          只保存一份; 压缩段中只属于该段的整页推迟到首次访问时才解压.
+          其余页中只属于一个段、且内容是只读缓冲区中完整一页的页直接引用该缓冲区 (MP_COW);
+          剩下的页先以可写权限映射并写入, 再设置最终权限
+        """
         with self.lock:
-            self.memory_page_table = {}
-            self.free_memory_list = self.FreeMemory(0, 0)
-            address = 0
-
-            # 初始化text段
-            self._set_memory_page(address, MemoryPageFlag.MP_READ | MemoryPageFlag.MP_EXEC | MemoryPageFlag.MP_WRITE)
-            current_page = self._get_memory_page(address)
-            address += self.PAGE_SIZE
-
-            offset = 0
-            for b in text:
-                current_page.set_byte(offset, b)
-                offset += 1
-                if offset == self.PAGE_SIZE:
-                    current_page.flags &= ~MemoryPageFlag.MP_WRITE
-                    self._set_memory_page(address,
-                                          MemoryPageFlag.MP_READ | MemoryPageFlag.MP_EXEC | MemoryPageFlag.MP_WRITE)
-                    current_page = self._get_memory_page(address)
-                    address += self.PAGE_SIZE
-                    offset = 0
-
-            # 初始化rodata段
-            current_page.flags = MemoryPageFlag.MP_READ
-            for b in rodata:
-                current_page.set_byte(offset, b)
-                offset += 1
-                if offset == self.PAGE_SIZE:
-                    self._set_memory_page(address, MemoryPageFlag.MP_READ)
-                    current_page = self._get_memory_page(address)
-                    address += self.PAGE_SIZE
-                    offset = 0
-
-            # 初始化data段
-            current_page.flags = MemoryPageFlag.MP_READ | MemoryPageFlag.MP_WRITE
-            for b in data:
-                current_page.set_byte(offset, b)
-                offset += 1
-                if offset == self.PAGE_SIZE:
-                    self._set_memory_page(address, MemoryPageFlag.MP_READ | MemoryPageFlag.MP_WRITE)
-                    current_page = self._get_memory_page(address)
-                    address += self.PAGE_SIZE
-                    offset = 0
+            self.reset()
+            page_flags: dict[int, int] = {}
+            owners: dict[int, Optional[Section]] = {}
+            end = 0
+            for section in sections:
+                if not section.length:
+                    continue
+                last = section.address + section.length
+                end = max(end, last)
+                for page_number in range(section.address >> MemoryPage.PAGE_SHIFT,
+                                         ((last - 1) >> MemoryPage.PAGE_SHIFT) + 1):
+                    page_flags[page_number] = page_flags.get(page_number, 0) | section.flags
+                    owners[page_number] = section if page_number not in owners else None
+            for page_number in range((end >> MemoryPage.PAGE_SHIFT) + 1):
+                page_flags.setdefault(page_number, 0)
+
+            for page_number in page_flags:
+                self._set_memory_page(page_number << MemoryPage.PAGE_SHIFT,
+                                      MemoryPageFlag.MP_READ | MemoryPageFlag.MP_WRITE)
+            # 不可写页的内容先汇集在这里, 最后放入共享页库, 不占用本实例的页缓冲区
+            shared_pages = {page_number: bytearray(MemoryPage.PAGE_SIZE)
+                            for page_number, flags in page_flags.items()
+                            if flags and not flags & MemoryPageFlag.MP_WRITE}
+            for section in sections:
+                if section.compressed:
+                    self._map_compressed(section, owners, shared_pages)
+                    continue
+                content = memoryview(section.content).cast('B')
+                position = 0
+                while position < section.length:
+                    address = section.address + position
+                    size = min(section.length - position,
+                               MemoryPage.PAGE_SIZE - (address & MemoryPage.PAGE_OFFSET_MASK))
+                    page_number = address >> MemoryPage.PAGE_SHIFT
+                    whole = (owners[page_number] is section and not address & MemoryPage.PAGE_OFFSET_MASK and
+                             position + MemoryPage.PAGE_SIZE <= len(content))
+                    if whole and page_number in shared_pages:
+                        shared_pages[page_number] = content[position:position + MemoryPage.PAGE_SIZE]
+                    elif whole and content.readonly:
+                        self.memory_page_table[page_number].share(content[position:position + MemoryPage.PAGE_SIZE])
+                    else:
+                        self._write_image(address, content[position:position + size], shared_pages)
+                    position += size
+            for page_number, content in shared_pages.items():
+                self.memory_page_table[page_number].share(self.page_store.intern(content))
+            for page_number, flags in page_flags.items():
+                page = self.memory_page_table[page_number]
+                page.flags = ((page.flags & (MemoryPageFlag.MP_PRESENT | MemoryPageFlag.MP_COW)) |
+                              (flags or MemoryPageFlag.MP_READ | MemoryPageFlag.MP_WRITE))
+            address = (max(page_flags) + 1) << MemoryPage.PAGE_SHIFT
 
             # 初始化bss段
+            bss_start = address
             mapped = 0
             while mapped < bss_section_length:
                 mapped += self.PAGE_SIZE
                 self._set_memory_page(address, MemoryPageFlag.MP_READ | MemoryPageFlag.MP_WRITE)
                 address += self.PAGE_SIZE
 
-            # 设置空闲内存链表
-            self.free_memory_list.next = self.FreeMemory(
-                address - self.PAGE_SIZE + (bss_section_length % self.PAGE_SIZE),
-                self.MAX_MEMORY_ADDRESS
-            )
+            # bss段之后的地址空间全部空闲
+            heap_start = self._align(bss_start + bss_section_length)
+            self.extents.insert(heap_start, min(self.large_page_base, self.MAX_MEMORY_ADDRESS))
+            if self.large_page_base <= self.MAX_MEMORY_ADDRESS:
+                self.large_extents.insert(self.large_page_base, self.MAX_MEMORY_ADDRESS)
+
+            # 预解码可执行段
+            for section in sections:
+                if not predecode_text and section.kind == TEXT_SECTION:
+                    continue
+                if section.flags & MemoryPageFlag.MP_EXEC:
+                    self.instruction_cache.predecode(section.address, section.address + section.length)
+
+    def reset(self):
+        """移除全部内存页并清空分配器、区域与线程栈的状态"""
+        with self.lock:
+            for page in self.memory_page_table.values():
+                page.destroy()
+            self.memory_page_table = {}
+            for translation_buffer in list(self.translation_buffers):
+                translation_buffer.flush()
+            self.instruction_cache.clear()
+            self.small_free_lists = [[] for _ in range(self.SMALL_BLOCK_LIMIT // self.BLOCK_ALIGNMENT)]
+            self.extents = FreeExtents()
+            self.large_extents = FreeExtents()
+            self.heap_extents = self.large_extents if self.large_page_base <= self.MAX_MEMORY_ADDRESS \
+                else self.extents
+            self.arena_chunks = {}
+            self.orphan_chunks = {}
+            self.regions = {}
+            self.stacks = []
+
+    def _map_compressed(self, section: Section, owners: dict[int, Optional[Section]],
+                        shared_pages: dict[int, bytearray]):
+        for index in range(section.pageCount()):
+            address = section.address + index * MemoryPage.PAGE_SIZE
+            page_number = address >> MemoryPage.PAGE_SHIFT
+            if not section.address & MemoryPage.PAGE_OFFSET_MASK and owners[page_number] is section:
+                loader = functools.partial(section.load, index)
+                if shared_pages.pop(page_number, None) is not None:
+                    # 解压后再放入共享页库
+                    loader = functools.partial(self._intern_loaded, loader)
+                self.memory_page_table[page_number].defer(loader)
+            else:
+                self._write_image(address, section.page(index), shared_pages)
+
+    def _intern_loaded(self, loader, record: bool = True) -> memoryview:
+        return self.page_store.intern(loader(record=record))
+
+    def _write_image(self, address: int, content, shared_pages: dict[int, bytearray]):
+        """写入映像内容, 落在不可写页上的部分写入 shared_pages 中该页的缓冲区"""
+        position = 0
+        while position < len(content):
+            offset = (address + position) & MemoryPage.PAGE_OFFSET_MASK
+            size = min(len(content) - position, MemoryPage.PAGE_SIZE - offset)
+            buffer = shared_pages.get((address + position) >> MemoryPage.PAGE_SHIFT)
+            if buffer is None:
+                self.write_bytes(address + position, content[position:position + size])
+            else:
+                buffer[offset:offset + size] = content[position:position + size]
+            position += size
 
     def allocate_memory(self, size: int) -> int:
+        length = self._block_length(size)
         with self.lock:
-            length = size + 8
-            free_mem = self.free_memory_list
-
-            while free_mem:
-                if free_mem.end - free_mem.start >= length:
-                    start = free_mem.start
-                    free_mem.start += length
-
-                    # 分配物理页
-                    addr = start
-                    remaining = length
-                    while remaining > 0:
-                        self._set_memory_page(addr & ~self.PAGE_OFFSET_MASK,
-                                              MemoryPageFlag.MP_READ | MemoryPageFlag.MP_WRITE)
-                        chunk = min(remaining, self.PAGE_SIZE - (addr & self.PAGE_OFFSET_MASK))
-                        remaining -= chunk
-                        addr += chunk
-
-                    # 存储分配大小
-                    self.set_long(start, size)
-                    return start + 8
-                free_mem = free_mem.next
-
-            raise RuntimeError("Out of memory")
+            if length <= self.SMALL_BLOCK_LIMIT:
+                free_list = self.small_free_lists[length // self.BLOCK_ALIGNMENT - 1]
+                if free_list:
+                    start = free_list.pop()
+                    orphan = self.orphan_chunks.get(start >> AllocationArena.CHUNK_SHIFT)
+                    if orphan is not None and start < orphan[1]:
+                        orphan[0] += 1
+                    return start + self.BLOCK_HEADER_SIZE
+                # 小块留在4KiB页上, 避免首次写入就复制整个大页
+                start = self.extents.take(length)
+            else:
+                start = self.heap_extents.take(length)
+            self._retain_pages(start, start + length)
+            # 存储块的可用大小
+            self.set_long(start, length - self.BLOCK_HEADER_SIZE)
+            return start + self.BLOCK_HEADER_SIZE
 
     def free_memory(self, address: int):
+        start = address - self.BLOCK_HEADER_SIZE
+        chunk = start >> AllocationArena.CHUNK_SHIFT
         with self.lock:
-            addr = address - 8
-            size = self.get_long(addr) + 8
-            free_mem = self.free_memory_list
-
-            # 查找合适的空闲块位置
-            while free_mem.next:
-                if free_mem.end == addr:
-                    free_mem.end += size
-                    break
-                elif free_mem.next.start == addr + size:
-                    free_mem.next.start -= size
-                    break
-                elif free_mem.end < addr and free_mem.next.start > addr + size:
-                    new_block = self.FreeMemory(addr, addr + size)
-                    new_block.next = free_mem.next
-                    free_mem.next = new_block
-                    break
-                free_mem = free_mem.next
-
-            # 释放物理页
-            remaining = size
-            while remaining > 0:
-                page_addr = addr & ~self.PAGE_OFFSET_MASK
-                page = self._get_memory_page(page_addr)
-                if page:
-                    page.release()
-                    if page.ref_count <= 0:
-                        self._remove_memory_page(page_addr)
-
-                chunk = min(remaining, self.PAGE_SIZE - (addr & self.PAGE_OFFSET_MASK))
-                remaining -= chunk
-                addr += chunk
+            # 在锁内查找所属线程, 保证不会交给已经销毁的分配区
+            owner = self.arena_chunks.get(chunk)
+            if owner is not None:
+                # 线程分配区中的块交还给其所属线程
+                owner.remote_frees.append(start)
+                return
+            length = self.get_long(start) + self.BLOCK_HEADER_SIZE
+            if length <= self.SMALL_BLOCK_LIMIT:
+                # 小块留在原页上等待复用
+                self.small_free_lists[length // self.BLOCK_ALIGNMENT - 1].append(start)
+                orphan = self.orphan_chunks.get(chunk)
+                if orphan is not None and start < orphan[1]:
+                    orphan[0] -= 1
+                    if not orphan[0]:
+                        self._release_orphan_chunk(chunk)
+                return
+
+            self._release_pages(start, start + length)
+            self._insert_extent(start, start + length)
+
+    def reallocate_memory(self, address: int, size: int) -> int:
+        """重新分配内存, 保留 min(旧大小, size) 字节内容; 能原地扩展或收缩时不移动数据"""
+        if not address:
+            return self.allocate_memory(size)
+        with self.lock:
+            start = address - self.BLOCK_HEADER_SIZE
+            capacity = self.get_long(start)
+            length = capacity + self.BLOCK_HEADER_SIZE
+            new_length = self._block_length(size)
+
+            if new_length <= length:
+                if length > self.SMALL_BLOCK_LIMIT and new_length > self.SMALL_BLOCK_LIMIT:
+                    # 大块收缩时把尾部还给空闲区间
+                    self._retain_pages(start, start + new_length)
+                    self._release_pages(start, start + length)
+                    self.set_long(start, new_length - self.BLOCK_HEADER_SIZE)
+                    self._insert_extent(start + new_length, start + length)
+                return address
+
+            following = self._extents_for(start).starts.get(start + length)
+            if (length > self.SMALL_BLOCK_LIMIT and following is not None and
+                    following - start >= new_length):
+                # 紧邻的下一块空闲且足够大, 原地扩展
+                self._extents_for(start).remove(start + length, following)
+                if following > start + new_length:
+                    self._insert_extent(start + new_length, following)
+                self._retain_pages(start, start + new_length)
+                self._release_pages(start, start + length)
+                self.set_long(start, new_length - self.BLOCK_HEADER_SIZE)
+                return address
+
+            new_address = self.allocate_memory(size)
+            self.copy_within(new_address, address, min(capacity, size))
+            self.free_memory(address)
+            return new_address
+
+    def create_region(self) -> int:
+        """创建区域, 返回区域编号"""
+        with self.lock:
+            self.last_region_id += 1
+            self.regions[self.last_region_id] = MemoryRegion(self)
+            return self.last_region_id
+
+    def region_allocate(self, region_id: int, size: int) -> int:
+        return self._get_region(region_id).allocate(size)
+
+    def destroy_region(self, region_id: int):
+        """销毁区域, 一次释放其全部分配"""
+        with self.lock:
+            region = self._get_region(region_id)
+            del self.regions[region_id]
+            region.destroy()
+
+    def reserve_stack(self, size: int) -> int:
+        """
+          为线程栈保留地址区间, 返回栈底地址
+
+          区间最低处是不映射的守护页, 其上的栈页在首次访问时才映射
+        """
+        length = (size + MemoryPage.PAGE_OFFSET_MASK) & ~MemoryPage.PAGE_OFFSET_MASK
+        with self.lock:
+            guard = self.extents.take_aligned(length + MemoryPage.PAGE_SIZE, MemoryPage.PAGE_SIZE)
+            base = guard + MemoryPage.PAGE_SIZE
+            bisect.insort(self.stacks, (guard, base, base + length))
+            return base
+
+    def release_stack(self, base: int):
+        """释放线程栈已映射的页并交还其地址区间"""
+        with self.lock:
+            index = bisect.bisect_left(self.stacks, (base - MemoryPage.PAGE_SIZE,))
+            if index == len(self.stacks) or self.stacks[index][1] != base:
+                return
+            guard, base, end = self.stacks.pop(index)
+            for page_number in range(base >> MemoryPage.PAGE_SHIFT, end >> MemoryPage.PAGE_SHIFT):
+                if page_number in self.memory_page_table:
+                    self._release_pages(page_number << MemoryPage.PAGE_SHIFT,
+                                        (page_number + 1) << MemoryPage.PAGE_SHIFT)
+            self._insert_extent(guard, end)
+
+    def _get_region(self, region_id: int) -> "MemoryRegion":
+        region = self.regions.get(region_id)
+        if region is None:
+            raise RuntimeError(f"Invalid region: {region_id}")
+        return region
+
+    def _block_length(self, size: int) -> int:
+        return self._align(max(size, 1) + self.BLOCK_HEADER_SIZE)
+
+    def _align(self, value: int) -> int:
+        return (value + self.BLOCK_ALIGNMENT - 1) & -self.BLOCK_ALIGNMENT
+
+    def _extents_for(self, address: int) -> FreeExtents:
+        return self.large_extents if address >= self.large_page_base else self.extents
+
+    def _release_orphan_chunk(self, chunk: int):
+        """线程已结束的块中小块全部释放后, 从分级空闲栈中取出其空闲块并把该块交还空闲区间"""
+        start = chunk << AllocationArena.CHUNK_SHIFT
+        _, end = self.orphan_chunks.pop(chunk)
+        for free_list in self.small_free_lists:
+            free_list[:] = [block for block in free_list if not start <= block < end]
+        self._release_pages(start, end)
+        self._insert_extent(start, end)
+
+    def _insert_extent(self, start: int, end: int):
+        """把 [start, end) 交还给其所在地址区的空闲区间"""
+        self._extents_for(start).insert(start, end)
+
+    def _page_key(self, address: int) -> int:
+        if address < self.large_page_base:
+            return address >> MemoryPage.PAGE_SHIFT
+        return ~(address >> self.large_page_shift)
+
+    def _page_range(self, start: int, end: int) -> range:
+        """覆盖 [start, end) 的各页的起始地址"""
+        shift = self.large_page_shift if start >= self.large_page_base else MemoryPage.PAGE_SHIFT
+        return range(start >> shift << shift, end, 1 << shift)
+
+    def _retain_pages(self, start: int, end: int):
+        """为 [start, end) 映射物理页, 每个块对其覆盖的页各持有一次引用"""
+        for address in self._page_range(start, end):
+            self._set_memory_page(address, MemoryPageFlag.MP_READ | MemoryPageFlag.MP_WRITE)
+
+    def _release_pages(self, start: int, end: int):
+        """释放块对 [start, end) 覆盖的页的引用, 无引用的页被移除"""
+        for address in self._page_range(start, end):
+            page = self.memory_page_table.get(self._page_key(address))
+            if page:
+                page.release()
+                if page.ref_count <= 0:
+                    self._remove_memory_page(address)
 
     # 私有方法实现
-    def _get_indexes(self, address: int) -> tuple[int, int, int, int]:
-        return (
-            (address >> 39) & 0x1ff,
-            (address >> 30) & 0x1ff,
-            (address >> 21) & 0x1ff,
-            (address >> 12) & 0x1ff
-        )
+    def page_for(self, address: int) -> MemoryPage:
+        """返回address所在的内存页, 页表以页号为键 (4KiB页为 address >> 12, 大页见 _page_key)"""
+        if address < self.large_page_base:
+            page = self.memory_page_table.get(address >> MemoryPage.PAGE_SHIFT)
+        else:
+            page = self.memory_page_table.get(~(address >> self.large_page_shift))
+        if page is None:
+            return self._fault(address)
+        return page
 
-    def _set_memory_page(self, address: int, flags: MemoryPageFlag):
-        pgd, pud, pmd, pte = self._get_indexes(address)
+    def _fault(self, address: int) -> MemoryPage:
+        """缺页处理: 线程栈的页在首次访问时映射, 访问守护页报告栈溢出"""
+        with self.lock:
+            page = self.memory_page_table.get(address >> MemoryPage.PAGE_SHIFT)
+            if page is not None:
+                return page
+            index = bisect.bisect_right(self.stacks, (address, math.inf)) - 1
+            if index >= 0:
+                guard, base, end = self.stacks[index]
+                if guard <= address < base:
+                    raise StackOverflowError(f"Stack overflow at address 0x{address:016x}")
+                if address < end:
+                    self._set_memory_page(address & ~MemoryPage.PAGE_OFFSET_MASK,
+                                          MemoryPageFlag.MP_READ | MemoryPageFlag.MP_WRITE)
+                    return self.memory_page_table[address >> MemoryPage.PAGE_SHIFT]
+        raise RuntimeError(f"Page not found at address 0x{address:016x}")
 
-        # 创建各级页表
-        if pgd not in self.memory_page_table:
-            self.memory_page_table[pgd] = {}
-        if pud not in self.memory_page_table[pgd]:
-            self.memory_page_table[pgd][pud] = {}
-        if pmd not in self.memory_page_table[pgd][pud]:
-            self.memory_page_table[pgd][pud][pmd] = {}
+    def _set_memory_page(self, address: int, flags: MemoryPageFlag):
+        page_number = self._page_key(address)
 
         # 创建或更新页表项
-        if pte not in self.memory_page_table[pgd][pud][pmd]:
-            page = MemoryPage(flags)
-            self.memory_page_table[pgd][pud][pmd][pte] = page
+        page = self.memory_page_table.get(page_number)
+        if page is None:
+            page = MemoryPage(flags, self.large_arena if address >= self.large_page_base else self.arena)
+            self.memory_page_table[page_number] = page
         else:
-            page = self.memory_page_table[pgd][pud][pmd][pte]
             page.flags |= flags
 
         page.retain()
 
     def _remove_memory_page(self, address: int):
-        pgd, pud, pmd, pte = self._get_indexes(address)
+        page_number = self._page_key(address)
+        page = self.memory_page_table.pop(page_number, None)
+        if page is None:
+            return
+        for translation_buffer in list(self.translation_buffers):
+            translation_buffer.invalidate(page_number)
+        if page.decoded:
+            self.instruction_cache.invalidate(address & ~page.offset_mask, page.size)
+
+
+class TranslationBuffer(MemoryAccessor):
+    """
+      执行单元私有的直接映射TLB, 缓存 虚拟页号 -> 内存页
+
+      读写经由TLB转换地址, 命中时不访问Memory的页表; 分配、释放等其余操作转交给Memory
+    """
+    DEFAULT_SIZE = 64
+
+    def __init__(self, memory: Memory, size: int = DEFAULT_SIZE):
+        if size <= 0 or size & (size - 1):
+            raise ValueError(f"TLB size must be a power of two: {size}")
+        self.memory = memory
+        self.instruction_cache = memory.instruction_cache
+        self.lock = memory.lock
+        self.large_page_base = memory.large_page_base
+        self.large_page_shift = memory.large_page_shift
+        self.mask = size - 1
+        self.tags = [-1] * size
+        self.pages: list[Optional[MemoryPage]] = [None] * size
+        self.hits = 0
+        self.misses = 0
+        memory.translation_buffers.add(self)
+
+    def page_for(self, address: int) -> MemoryPage:
+        if address < self.large_page_base:
+            page_number = address >> MemoryPage.PAGE_SHIFT
+        else:
+            page_number = ~(address >> self.large_page_shift)
+        index = page_number & self.mask
+        if self.tags[index] == page_number:
+            self.hits += 1
+            return self.pages[index]
+
+        self.misses += 1
+        page = self.memory.page_for(address)
+        self.tags[index] = page_number
+        self.pages[index] = page
+        return page
+
+    def invalidate(self, page_number: int):
+        index = page_number & self.mask
+        if self.tags[index] == page_number:
+            self.tags[index] = -1
+            self.pages[index] = None
+
+    def flush(self):
+        for index in range(len(self.tags)):
+            self.tags[index] = -1
+            self.pages[index] = None
 
-        try:
-            del self.memory_page_table[pgd][pud][pmd][pte]
+    def allocate_memory(self, size: int) -> int:
+        return self.memory.allocate_memory(size)
 
-            # 清理空表
-            if not self.memory_page_table[pgd][pud][pmd]:
-                del self.memory_page_table[pgd][pud][pmd]
-            if not self.memory_page_table[pgd][pud]:
-                del self.memory_page_table[pgd][pud]
-            if not self.memory_page_table[pgd]:
-                del self.memory_page_table[pgd]
-        except KeyError:
-            pass
+    def free_memory(self, address: int):
+        self.memory.free_memory(address)
 
-    def _get_memory_page(self, address: int) -> MemoryPage:
-        pgd, pud, pmd, pte = self._get_indexes(address)
+    def reallocate_memory(self, address: int, size: int) -> int:
+        return self.memory.reallocate_memory(address, size)
 
-        try:
-            return self.memory_page_table[pgd][pud][pmd][pte]
-        except KeyError:
-            raise RuntimeError(f"Page not found at address 0x{address:016x}")
+    def create_region(self) -> int:
+        return self.memory.create_region()
 
-    # 内存读写方法 (简化实现)
-    def get_byte(self, address: int) -> int:
-        page = self._get_memory_page(address & ~self.PAGE_OFFSET_MASK)
-        return page.get_byte(address & self.PAGE_OFFSET_MASK)
+    def region_allocate(self, region_id: int, size: int) -> int:
+        return self.memory.region_allocate(region_id, size)
 
-    def set_byte(self, address: int, value: int):
-        page = self._get_memory_page(address & ~self.PAGE_OFFSET_MASK)
-        page.set_byte(address & self.PAGE_OFFSET_MASK, value)
+    def destroy_region(self, region_id: int):
+        self.memory.destroy_region(region_id)
 
-    def get_long(self, address: int) -> int:
-        value = 0
-        for i in range(8):
-            value |= self.get_byte(address + i) << (i * 8)
-        return value
 
-    def set_long(self, address: int, value: int):
-        for i in range(8):
-            self.set_byte(address + i, (value >> (i * 8)) & 0xFF)
+class MemoryRegion:
+    """
+      指针递增分配的内存区域
+
+      分配只移动bump指针, 单个分配不能单独释放; 空间不足时向全局分配器申请新段,
+      销毁时一次性交还全部段并移除其内存页
+    """
+    SEGMENT_SIZE = 64 * 1024
+
+    __slots__ = ('memory', 'segments', 'bump', 'end', 'lock')
+
+    def __init__(self, memory: Memory):
+        self.memory = memory
+        self.segments: list[tuple[int, int]] = []
+        self.bump = 0
+        self.end = 0
+        self.lock = threading.Lock()
+
+    def allocate(self, size: int) -> int:
+        length = self.memory._align(max(size, 1))
+        with self.lock:
+            if self.bump + length > self.end:
+                self._grow(length)
+            address = self.bump
+            self.bump += length
+            return address
+
+    def destroy(self):
+        memory = self.memory
+        with memory.lock:
+            for start, end in self.segments:
+                memory._release_pages(start, end)
+                memory._insert_extent(start, end)
+        self.segments.clear()
+        self.bump = self.end = 0
+
+    def _grow(self, length: int):
+        memory = self.memory
+        page_mask = memory.heap_page_size - 1
+        size = (max(self.SEGMENT_SIZE, length) + page_mask) & ~page_mask
+        with memory.lock:
+            start = memory.heap_extents.take_aligned(size, memory.heap_page_size)
+            memory._retain_pages(start, start + size)
+        self.segments.append((start, start + size))
+        self.bump = start
+        self.end = start + size
+
+
+class AllocationArena:
+    """
+      执行单元私有的小块分配区
+
+      小块从按 CHUNK_SIZE 对齐的整块中切分, 自身的空闲块按大小分级复用, 整个过程不获取Memory.lock;
+      只有补充新块或交还整块时才进入全局分配器. 其他线程释放的块放入 remote_frees 队列,
+      由所属线程在下次分配时回收
+    """
+    CHUNK_SHIFT = 16
+    CHUNK_SIZE = 1 << CHUNK_SHIFT
+
+    def __init__(self, memory: Memory):
+        self.memory = memory
+        self.free_lists: list[list[int]] = [[] for _ in range(Memory.SMALL_BLOCK_LIMIT // Memory.BLOCK_ALIGNMENT)]
+        # 块号 -> 未释放的小块数
+        self.live_blocks: dict[int, int] = {}
+        self.remote_frees: collections.deque[int] = collections.deque()
+        self.bump = 0
+        self.bump_end = 0
+
+    def allocate(self, size: int) -> int:
+        memory = self.memory
+        length = memory._block_length(size)
+        if length > Memory.SMALL_BLOCK_LIMIT:
+            return memory.allocate_memory(size)
+        if self.remote_frees:
+            self._drain_remote_frees()
+
+        free_list = self.free_lists[length // Memory.BLOCK_ALIGNMENT - 1]
+        if free_list:
+            start = free_list.pop()
+        else:
+            if self.bump + length > self.bump_end:
+                self._refill()
+            start = self.bump
+            self.bump += length
+            memory.set_long(start, length - Memory.BLOCK_HEADER_SIZE)
+        chunk = start >> self.CHUNK_SHIFT
+        self.live_blocks[chunk] += 1
+        return start + Memory.BLOCK_HEADER_SIZE
+
+    def free(self, address: int):
+        start = address - Memory.BLOCK_HEADER_SIZE
+        owner = self.memory.arena_chunks.get(start >> self.CHUNK_SHIFT)
+        if owner is self:
+            self._free_local(start)
+        else:
+            self.memory.free_memory(address)
+
+    def reallocate(self, address: int, size: int) -> int:
+        if not address:
+            return self.allocate(size)
+        start = address - Memory.BLOCK_HEADER_SIZE
+        if self.memory.arena_chunks.get(start >> self.CHUNK_SHIFT) is not self:
+            return self.memory.reallocate_memory(address, size)
+        capacity = self.memory.get_long(start)
+        if self.memory._block_length(size) <= capacity + Memory.BLOCK_HEADER_SIZE:
+            return address
+        new_address = self.allocate(size)
+        self.memory.copy_within(new_address, address, min(capacity, size))
+        self._free_local(start)
+        return new_address
+
+    def destroy(self):
+        """
+          交还空块与当前块未切分的尾部; 仍有存活小块的块转交给全局分配器 (Memory.orphan_chunks),
+          其空闲块并入全局的分级空闲栈, 存活小块全部释放后整块交还空闲区间
+        """
+        memory = self.memory
+        self._drain_remote_frees()
+        with memory.lock:
+            for chunk in self.live_blocks:
+                del memory.arena_chunks[chunk]
+            # 此后其他线程的释放不再进入 remote_frees, 之前已入队的在此回收
+            self._drain_remote_frees()
+            for index, free_list in enumerate(self.free_lists):
+                for start in free_list:
+                    if self.live_blocks[start >> self.CHUNK_SHIFT]:
+                        memory.small_free_lists[index].append(start)
+                free_list.clear()
+            current = (self.bump_end - self.CHUNK_SIZE) >> self.CHUNK_SHIFT if self.bump_end else None
+            for chunk, live in self.live_blocks.items():
+                start = chunk << self.CHUNK_SHIFT
+                end = start + self.CHUNK_SIZE
+                if not live:
+                    memory._release_pages(start, end)
+                    memory._insert_extent(start, end)
+                    continue
+                if chunk == current and self.bump < end:
+                    # bump所在的页仍有小块, 只释放其后的整页
+                    memory._release_pages((self.bump + MemoryPage.PAGE_OFFSET_MASK) & ~MemoryPage.PAGE_OFFSET_MASK, end)
+                    memory._insert_extent(self.bump, end)
+                    end = self.bump
+                memory.orphan_chunks[chunk] = [live, end]
+            self.live_blocks.clear()
+            self.bump = self.bump_end = 0
+
+    def _free_local(self, start: int):
+        length = self.memory.get_long(start) + Memory.BLOCK_HEADER_SIZE
+        self.free_lists[length // Memory.BLOCK_ALIGNMENT - 1].append(start)
+        self.live_blocks[start >> self.CHUNK_SHIFT] -= 1
+
+    def _drain_remote_frees(self):
+        remote_frees = self.remote_frees
+        while remote_frees:
+            self._free_local(remote_frees.popleft())
+
+    def _refill(self):
+        memory = self.memory
+        with memory.lock:
+            start = memory.extents.take_aligned(self.CHUNK_SIZE, self.CHUNK_SIZE)
+            memory._retain_pages(start, start + self.CHUNK_SIZE)
+            memory.arena_chunks[start >> self.CHUNK_SHIFT] = self
+        self.live_blocks[start >> self.CHUNK_SHIFT] = 0
+        self.bump = start
+        self.bump_end = start + self.CHUNK_SIZE
+
+
+class InstructionCache:
+    """预解码指令缓存, 以PC为键保存 (opcode, operands, next_pc)"""
+
+    def __init__(self, memory: Memory):
+        self.memory = memory
+        self.entries: dict[int, tuple[int, tuple[int, ...], int]] = {}
+        self.page_entries: dict[int, set[int]] = {}
+        # 每次可执行页被写入或缓存被清空时递增, 供JIT检查已编译代码是否过期
+        self.generation = 0
+        self.lock = threading.RLock()
+
+    def fetch(self, pc: int) -> tuple[int, tuple[int, ...], int]:
+        entry = self.entries.get(pc)
+        if entry is None:
+            entry = self.decode(pc)
+        return entry
+
+    def decode(self, pc: int) -> tuple[int, tuple[int, ...], int]:
+        """解码单条指令并写入缓存"""
+        with self.lock:
+            entry = self.read(pc)
+            self.store(pc, entry)
+            return entry
+
+    def read(self, pc: int) -> tuple[int, tuple[int, ...], int]:
+        """从内存解码单条指令, 不经过也不写入缓存"""
+        memory = self.memory
+        readers = {1: memory.get_byte, 2: memory.get_short, 4: memory.get_int, 8: memory.get_long}
+        code = memory.get_byte(pc)
+        address = pc + 1
+        operands = []
+        for width in ByteCode.instruction_operands.get(code, ()):
+            operands.append(readers[width](address))
+            address += width
+        return code, tuple(operands), address
+
+    def store(self, pc: int, entry: tuple[int, tuple, int]):
+        with self.lock:
+            self.entries[pc] = entry
+            for page_number in range(pc >> MemoryPage.PAGE_SHIFT, ((entry[2] - 1) >> MemoryPage.PAGE_SHIFT) + 1):
+                pcs = self.page_entries.get(page_number)
+                if pcs is None:
+                    pcs = self.page_entries[page_number] = set()
+                    # 任何可读的页上都可能有被执行的代码, 标记后写入该页时使缓存失效
+                    self.memory.page_for(page_number << MemoryPage.PAGE_SHIFT).decoded = True
+                pcs.add(pc)
+
+    def load(self, instructions: dict[int, tuple[int, tuple[int, ...], int]]):
+        """批量载入已解码的指令"""
+        with self.lock:
+            for pc, entry in instructions.items():
+                self.store(pc, entry)
+
+    def predecode(self, start: int, end: int):
+        """线性扫描 [start, end) 并预解码所有指令"""
+        pc = start
+        while pc < end:
+            try:
+                pc = self.decode(pc)[2]
+            except RuntimeError:
+                break
+
+    def invalidate(self, address: int, length: int = 1):
+        """丢弃 [address, address + length) 覆盖的各4KiB页上的全部已解码指令"""
+        with self.lock:
+            self.generation += 1
+            for page_number in range(address >> MemoryPage.PAGE_SHIFT,
+                                     ((address + length - 1) >> MemoryPage.PAGE_SHIFT) + 1):
+                pcs = self.page_entries.pop(page_number, None)
+                if pcs:
+                    for pc in pcs:
+                        self.entries.pop(pc, None)
+
+    def clear(self):
+        with self.lock:
+            self.generation += 1
+            self.entries.clear()
+            self.page_entries.clear()
+
+    def fuse(self, start: int, end: int) -> dict[str, int]:
+        """把 [start, end) 中已预解码的常见指令序列替换为超级指令, 返回各类融合的次数"""
+        counts = {name: 0 for name in SuperInstruction.instruction_names.values()}
+        with self.lock:
+            pc = start
+            while pc < end and pc in self.entries:
+                entry = self._fuse_at(self.entries[pc])
+                if entry[0] in SuperInstruction.instruction_names:
+                    self.store(pc, entry)
+                    counts[SuperInstruction.instruction_names[entry[0]]] += 1
+                pc = entry[2]
+        return counts
+
+    def _fuse_at(self, entry: tuple[int, tuple, int]) -> tuple[int, tuple, int]:
+        code, operands, next_pc = entry
+        following = self.entries.get(next_pc)
+        if following is None:
+            return entry
+
+        # 比较PC的CMP读到的是CMP之后的PC, 融合后会变成条件跳转之后的PC, 不参与融合
+        if (code == ByteCode.CMP and ByteCode.is_conditional_jump(following[0]) and
+                ByteCode.PC_REGISTER not in operands[1:]):
+            return (SuperInstruction.CMP_JUMP,
+                    operands + (following[0] - ByteCode.JE,) + following[1],
+                    following[2])
+
+        # 目标为PC的立即数加载本身就是跳转, 不能与后继指令融合
+        if (ByteCode.MOV_IMMEDIATE1 <= code <= ByteCode.MOV_IMMEDIATE8 and
+                operands[1] != ByteCode.PC_REGISTER and following[0] in (ByteCode.ADD, ByteCode.SUB)):
+            super_code = SuperInstruction.MOV_IMMEDIATE_ADD if following[0] == ByteCode.ADD \
+                else SuperInstruction.MOV_IMMEDIATE_SUB
+            return super_code, operands + following[1], following[2]
+
+        for first, last, super_code in ((ByteCode.PUSH_1, ByteCode.PUSH_8, SuperInstruction.PUSH_RUN),
+                                        (ByteCode.POP_1, ByteCode.POP_8, SuperInstruction.POP_RUN)):
+            # 读写PC的入栈/出栈依赖逐条更新的PC, 不参与融合
+            run = []
+            current = entry
+            while (current is not None and first <= current[0] <= last and
+                   current[1][0] != ByteCode.PC_REGISTER):
+                run.append((current[0], current[1]))
+                next_pc = current[2]
+                current = self.entries.get(next_pc)
+            if len(run) >= 2:
+                return super_code, tuple(run), next_pc
+
+        return entry
 
 
 class ThreadHandle:
-    def __init__(self, eu: "ExecutionUnit"):
-        self.eu = eu
-        self.thread = threading.Thread(target=self.eu.run())
+    def __init__(self, execution_unit: "ExecutionUnit"):
+        self.execution_unit = execution_unit
+        self.thread = threading.Thread(target=self.execution_unit.run)
 
 
 class VirtualMachine:
-    LVM_VERSION = 0
-
-    def __init__(self, stack_size: int):
+    LVM_VERSION = 3
+
+    # 指令分派方式
+    DISPATCH_MATCH = "match"
+    DISPATCH_TABLE = "table"
+    DISPATCH_AOT = "aot"
+    DISPATCH_MODES = (DISPATCH_MATCH, DISPATCH_TABLE, DISPATCH_AOT)
+
+    def __init__(self, stack_size: int, dispatch: str = DISPATCH_MATCH, fusion: bool = True,
+                 aot_cache_dir: str = "", jit: bool = False, jit_threshold: int = 50,
+                 tlb_size: int = TranslationBuffer.DEFAULT_SIZE, heap_page_size: int = MemoryPage.PAGE_SIZE,
+                 code_cache_dir: str = "", code_cache_size: int = DEFAULT_CODE_CACHE_SIZE):
+        if dispatch not in self.DISPATCH_MODES:
+            raise ValueError(f"Unknown dispatch mode: {dispatch}")
         self.stack_size = stack_size
-        self.memory = Memory()
+        self.dispatch = dispatch
+        self.fusion = fusion
+        self.fusion_counts: dict[str, int] = {}
+        self.aot_cache_dir = aot_cache_dir
+        self.aot_blocks: dict[int, object] = {}
+        # 翻译aot_blocks时指令缓存的generation, 之后text被改写则不再执行这些块
+        self.aot_generation = 0
+        self.jit = None
+        if jit and dispatch != self.DISPATCH_AOT:
+            # jit模块依赖本模块, 在此处延迟导入
+            from ldk.l.lvm.jit import TraceJIT
+            self.jit = TraceJIT(self, jit_threshold)
+        self.code_cache = CodeCache(code_cache_dir, code_cache_size) if code_cache_dir else None
+        self.memory = Memory(heap_page_size)
+        self.tlb_size = tlb_size
+        # 已结束执行单元的TLB命中/未命中累计
+        self.tlb_stats = {"hits": 0, "misses": 0}
         self.thread_id_to_handle: dict[int, ThreadHandle] = {}
         self.fd_to_file_handle: dict[int, FileHandle] = {}
         self.entry_point = 0
+        self.text_length = 0
         self.running = False
         self.last_thread_id = 0
         self.last_fd = 2
         self.lock = threading.RLock()
 
     def init(self, module: Module) -> int:
-        """初始化虚拟机并加载模块"""
-        self.memory.init(
-            module.text,
-            module.rodata,
-            module.data,
-            module.bssSectionLength
-        )
+        """
+          初始化虚拟机并加载模块
+
+          text段在映射后从内存读取, 压缩的text段因此只在页首次访问时解压一次
+        """
+        section = module.section(TEXT_SECTION)
+        text_length = section.length if section is not None else 0
+        self.memory.init(module.sections, module.bssSectionLength, self.code_cache is None)
+        text = self.memory.read_bytes(0, text_length)
+        decoded = None
+        if self.code_cache is not None:
+            cache = self.memory.instruction_cache
+            decoded = self.code_cache.load(text, module.entrypoint, self.LVM_VERSION)
+            if decoded is None:
+                cache.predecode(0, text_length)
+                decoded = self._store_decoded(module, text)
+            else:
+                cache.load(decoded[0])
         self.entry_point = module.entrypoint
+        self.text_length = text_length
+        if self.fusion:
+            self.fusion_counts = self.memory.instruction_cache.fuse(0, text_length)
+        if self.dispatch == self.DISPATCH_AOT:
+            # aot模块依赖本模块, 在此处延迟导入
+            from ldk.l.lvm.aot import compile_module
+            text_module = Module(text, b"", b"", 0, module.entrypoint)
+            self.aot_blocks = compile_module(text_module, self.aot_cache_dir, decoded).BLOCKS
+            self.aot_generation = self.memory.instruction_cache.generation
+        self._init_standard_streams()
+        return 0
 
-        # 初始化标准输入/输出/错误
+    def _init_standard_streams(self):
+        """初始化标准输入/输出/错误"""
         self.fd_to_file_handle[0] = FileHandle(
             "<stdin>",
             FileHandle.FH_READ,
@@ -748,12 +1979,26 @@ class VirtualMachine:
             None,
             sys.stderr.buffer
         )
-        return 0
+
+    def _store_decoded(self, module: Module, text) -> tuple[dict, list[int]]:
+        """把刚预解码的text段指令表 (融合前) 与基本块起始地址写入CodeCache"""
+        from ldk.l.lvm.aot import find_leaders
+        instructions = {pc: entry for pc, entry in self.memory.instruction_cache.entries.items()
+                        if entry[2] <= len(text)}
+        leaders = find_leaders(instructions, module.entrypoint)
+        self.code_cache.store(text, module.entrypoint, self.LVM_VERSION, instructions, leaders)
+        return instructions, leaders
 
     def run(self) -> int:
-        """启动虚拟机主循环"""
-        self.create_thread(self.entry_point)
-        self.running = True
+        """启动虚拟机主循环; 从快照恢复时继续执行快照中的线程, 否则从入口地址创建主线程"""
+        pending = [handle for handle in self.thread_id_to_handle.values() if handle.thread.ident is None]
+        if pending:
+            self.running = True
+            for handle in pending:
+                handle.thread.start()
+        else:
+            self.create_thread(self.entry_point)
+            self.running = True
 
         # 等待所有线程完成
         while self.running and self.thread_id_to_handle:
@@ -770,6 +2015,17 @@ class VirtualMachine:
                     print(f"Thread join error: {e}")
         return 0
 
+    def snapshot(self, path: str):
+        """把内存、线程与可重新打开的文件写入快照文件, 调用时不能有正在运行的线程"""
+        # snapshot模块依赖本模块, 在此处延迟导入
+        from ldk.l.lvm.snapshot import write_snapshot
+        write_snapshot(self, path)
+
+    def restore(self, path: str):
+        """用快照替换虚拟机的全部状态, 之后 run() 继续执行快照中的线程"""
+        from ldk.l.lvm.snapshot import read_snapshot
+        read_snapshot(self, path)
+
     def create_thread(self, entry_point: int) -> int:
         """创建新线程"""
         thread_id = self._get_thread_id()
@@ -784,8 +2040,9 @@ class VirtualMachine:
 
     def _create_execution_unit(self, thread_id: int, entry_point: int) -> "ExecutionUnit":
         """创建执行单元"""
-        stack_start = self.memory.allocate_memory(self.stack_size)
+        stack_start = self.memory.reserve_stack(self.stack_size)
         execution_unit = ExecutionUnit(self)
+        execution_unit.stack_base = stack_start
         execution_unit.init(
             thread_id,
             stack_start + self.stack_size - 1,
@@ -870,6 +2127,9 @@ class ExecutionUnit:
         self.flags = 0
         self.result = 0
         self.running = False
+        self.tlb = TranslationBuffer(virtual_machine.memory, virtual_machine.tlb_size)
+        self.heap = AllocationArena(virtual_machine.memory)
+        self.stack_base = 0
 
     def init(self, threadID: int, stack_start: int, entrypoint: int):
         self.threadID = threadID
@@ -884,21 +2144,27 @@ class ExecutionUnit:
         self.registers[register] = value
 
     def execute(self):
+        if self.virtual_machine.dispatch == VirtualMachine.DISPATCH_TABLE or self.virtual_machine.jit is not None:
+            self.execute_table()
+            return
+        if self.virtual_machine.dispatch == VirtualMachine.DISPATCH_AOT:
+            self.execute_aot()
+            return
+
         self.running = True
+        fetch = self.virtual_machine.memory.instruction_cache.fetch
         while self.running:
             pc = self.get_register(ByteCode.PC_REGISTER)
-            code = self.virtual_machine.memory.get_byte(pc)
-            pc += 1
+            code, operands, next_pc = fetch(pc)
 
             match code:
                 case ByteCode.NOP:
-                    self.set_register(ByteCode.PC_REGISTER, pc)
+                    self.set_register(ByteCode.PC_REGISTER, next_pc)
 
                 # 内存操作指令
                 case ByteCode.PUSH_1 | ByteCode.PUSH_2 | ByteCode.PUSH_4 | ByteCode.PUSH_8:
-                    register = self.virtual_machine.memory.get_byte(pc)
-                    pc += 1
-                    self.set_register(ByteCode.PC_REGISTER, pc)
+                    register, = operands
+                    self.set_register(ByteCode.PC_REGISTER, next_pc)
 
                     sp = self.get_register(ByteCode.SP_REGISTER)
                     size = 1 << (code - ByteCode.PUSH_1)
@@ -907,21 +2173,18 @@ class ExecutionUnit:
 
                     value = self.get_register(register)
                     if size == 1:
-                        self.virtual_machine.memory.set_byte(sp, value)
+                        self.tlb.set_byte(sp, value)
                     elif size == 2:
-                        self.virtual_machine.memory.set_short(sp, value)
+                        self.tlb.set_short(sp, value)
                     elif size == 4:
-                        self.virtual_machine.memory.set_int(sp, value)
+                        self.tlb.set_int(sp, value)
                     else:  # size == 8
-                        self.virtual_machine.memory.set_long(sp, value)
+                        self.tlb.set_long(sp, value)
 
                 # 比较指令
                 case ByteCode.CMP:
-                    type_ = self.virtual_machine.memory.get_byte(pc)
-                    operand1 = self.virtual_machine.memory.get_byte(pc + 1)
-                    operand2 = self.virtual_machine.memory.get_byte(pc + 2)
-                    pc += 3
-                    self.set_register(ByteCode.PC_REGISTER, pc)
+                    type_, operand1, operand2 = operands
+                    self.set_register(ByteCode.PC_REGISTER, next_pc)
 
                     value1 = self.get_register(operand1)
                     value2 = self.get_register(operand2)
@@ -952,27 +2215,20 @@ class ExecutionUnit:
 
                 # 移动指令
                 case ByteCode.MOV:
-                    source = self.virtual_machine.memory.get_byte(pc)
-                    target = self.virtual_machine.memory.get_byte(pc + 1)
-                    pc += 2
-                    self.set_register(ByteCode.PC_REGISTER, pc)
+                    source, target = operands
+                    self.set_register(ByteCode.PC_REGISTER, next_pc)
                     self.set_register(target, self.get_register(source))
 
                 # 立即数加载
                 case ByteCode.MOV_IMMEDIATE1:
-                    value = self.virtual_machine.memory.get_byte(pc)
-                    target = self.virtual_machine.memory.get_byte(pc + 1)
-                    pc += 2
-                    self.set_register(ByteCode.PC_REGISTER, pc)
+                    value, target = operands
+                    self.set_register(ByteCode.PC_REGISTER, next_pc)
                     self.set_register(target, value)
 
                 # 算术运算
                 case ByteCode.ADD:
-                    operand1 = self.virtual_machine.memory.get_byte(pc)
-                    operand2 = self.virtual_machine.memory.get_byte(pc + 1)
-                    result_reg = self.virtual_machine.memory.get_byte(pc + 2)
-                    pc += 3
-                    self.set_register(ByteCode.PC_REGISTER, pc)
+                    operand1, operand2, result_reg = operands
+                    self.set_register(ByteCode.PC_REGISTER, next_pc)
 
                     val1 = self.get_register(operand1)
                     val2 = self.get_register(operand2)
@@ -980,32 +2236,22 @@ class ExecutionUnit:
 
                 # 跳转指令
                 case ByteCode.JUMP:
-                    address_reg = self.virtual_machine.memory.get_byte(pc)
-                    pc += 1
+                    address_reg, = operands
                     self.set_register(ByteCode.PC_REGISTER, self.get_register(address_reg))
 
                 case ByteCode.JE:
-                    address_reg = self.virtual_machine.memory.get_byte(pc)
-                    pc += 1
-                    self.set_register(ByteCode.PC_REGISTER, pc)
+                    address_reg, = operands
+                    self.set_register(ByteCode.PC_REGISTER, next_pc)
                     if self.flags & ByteCode.ZERO_MARK:
                         self.set_register(ByteCode.PC_REGISTER, self.get_register(address_reg))
 
                 # 系统调用
                 case ByteCode.OPEN:
-                    path_reg = self.virtual_machine.memory.get_byte(pc)
-                    flags_reg = self.virtual_machine.memory.get_byte(pc + 1)
-                    mode_reg = self.virtual_machine.memory.get_byte(pc + 2)
-                    result_reg = self.virtual_machine.memory.get_byte(pc + 3)
-                    pc += 4
-                    self.set_register(ByteCode.PC_REGISTER, pc)
+                    path_reg, flags_reg, mode_reg, result_reg = operands
+                    self.set_register(ByteCode.PC_REGISTER, next_pc)
 
                     # 从内存读取路径字符串
-                    address = self.get_register(path_reg)
-                    path = bytearray()
-                    while (byte_val := self.virtual_machine.memory.get_byte(address)) != 0:
-                        path.append(byte_val)
-                        address += 1
+                    path = self.tlb.read_string(self.get_register(path_reg))
 
                     try:
                         fd = self.virtual_machine.open(
@@ -1019,44 +2265,72 @@ class ExecutionUnit:
 
                 # 函数调用/返回
                 case ByteCode.INVOKE:
-                    address_reg = self.virtual_machine.memory.get_byte(pc)
-                    pc += 1
+                    address_reg, = operands
                     sp = self.get_register(ByteCode.SP_REGISTER) - 8
-                    self.virtual_machine.memory.set_long(sp, pc)
+                    self.tlb.set_long(sp, next_pc)
                     self.set_register(ByteCode.SP_REGISTER, sp)
                     self.set_register(ByteCode.PC_REGISTER, self.get_register(address_reg))
 
                 case ByteCode.RETURN:
                     sp = self.get_register(ByteCode.SP_REGISTER)
-                    return_addr = self.virtual_machine.memory.get_long(sp)
+                    return_addr = self.tlb.get_long(sp)
                     self.set_register(ByteCode.SP_REGISTER, sp + 8)
                     self.set_register(ByteCode.PC_REGISTER, return_addr)
 
                 # 线程控制
                 case ByteCode.CREATE_THREAD:
-                    entry_point = self.virtual_machine.memory.get_long(pc)
-                    result_reg = self.virtual_machine.memory.get_byte(pc + 8)
-                    pc += 9
-                    self.set_register(ByteCode.PC_REGISTER, pc)
+                    entry_point, result_reg = operands
+                    self.set_register(ByteCode.PC_REGISTER, next_pc)
                     thread_id = self.virtual_machine.create_thread(entry_point)
                     self.set_register(result_reg, thread_id)
 
                 # 退出指令
                 case ByteCode.EXIT:
-                    exit_code_reg = self.virtual_machine.memory.get_byte(pc)
+                    exit_code_reg, = operands
                     self.virtual_machine.exit(self.get_register(exit_code_reg))
                     self.running = False
 
-                # 其他指令处理...
+                # 其他指令及超级指令交给分派表中的处理函数
+                case _ if code in ByteCode.instruction_names or code in SuperInstruction.instruction_names:
+                    self.set_register(ByteCode.PC_REGISTER, next_pc)
+                    DISPATCH_TABLE[code](self, self.registers, self.tlb, operands)
+
                 case _:
-                    # 默认处理：打印未实现指令并继续
-                    try:
-                        instr_name = ByteCode.get_instruction_name(code)
-                        print(f"Unimplemented instruction: {instr_name} at PC={pc - 1}")
-                        self.set_register(ByteCode.PC_REGISTER, pc)
-                    except ValueError:
-                        print(f"Unknown instruction code: {code} at PC={pc - 1}")
-                        self.running = False
+                    print(f"Unknown instruction code: {code} at PC={pc}")
+                    self.running = False
+
+    def execute_table(self):
+        """基于256项处理函数表的分派循环, 启用JIT时跳转指令换成带热度计数的处理函数"""
+        registers = self.registers
+        memory = self.tlb
+        fetch = memory.instruction_cache.fetch
+        jit = self.virtual_machine.jit
+        handlers = jit.handlers if jit is not None else DISPATCH_TABLE
+        self.running = True
+        while self.running:
+            code, operands, registers[ByteCode.PC_REGISTER] = fetch(registers[ByteCode.PC_REGISTER])
+            handlers[code](self, registers, memory, operands)
+
+    def execute_aot(self):
+        """
+          执行AOT编译的基本块, 不是块起点的地址逐条交给解释器执行;
+          可执行页被写入 (指令缓存的generation变化) 后已翻译的块可能过期, 此后全部交给解释器
+        """
+        registers = self.registers
+        memory = self.tlb
+        cache = memory.instruction_cache
+        fetch = cache.fetch
+        blocks = self.virtual_machine.aot_blocks
+        generation = self.virtual_machine.aot_generation
+        handlers = DISPATCH_TABLE
+        self.running = True
+        while self.running:
+            block = blocks.get(registers[ByteCode.PC_REGISTER]) if cache.generation == generation else None
+            if block is not None:
+                registers[ByteCode.PC_REGISTER] = block(self, registers, memory)
+            else:
+                code, operands, registers[ByteCode.PC_REGISTER] = fetch(registers[ByteCode.PC_REGISTER])
+                handlers[code](self, registers, memory, operands)
 
     def run(self):
         try:
@@ -1065,3 +2339,780 @@ class ExecutionUnit:
             print(f"Thread {self.threadID} crashed: {e}")
             self.virtual_machine.exit(1)
 
+    def destroy(self):
+        self.running = False
+        self.heap.destroy()
+        if self.stack_base:
+            self.virtual_machine.memory.release_stack(self.stack_base)
+            self.stack_base = 0
+        with self.virtual_machine.lock:
+            self.virtual_machine.tlb_stats["hits"] += self.tlb.hits
+            self.virtual_machine.tlb_stats["misses"] += self.tlb.misses
+        self.tlb.hits = self.tlb.misses = 0
+
+
+
+# ---------------------------------------------------------------------------
+# 表驱动分派: 处理函数签名为 handler(eu, registers, memory, operands)
+# 调用前 registers[PC_REGISTER] 已指向下一条指令
+# ---------------------------------------------------------------------------
+
+_MASK64 = 0xFFFFFFFFFFFFFFFF
+_PC = ByteCode.PC_REGISTER
+_SP = ByteCode.SP_REGISTER
+_BP = ByteCode.BP_REGISTER
+_FLAG_MASK = ByteCode.ZERO_MARK | ByteCode.CARRY_MARK | ByteCode.UNSIGNED_MARK
+
+# 条件码真值表, 以 flags & _FLAG_MASK 为下标, 顺序与 JE..JUGE / MOV_E..MOV_UGE 一致
+_CONDITIONS = tuple(
+    tuple(bool(condition(flags)) for flags in range(_FLAG_MASK + 1))
+    for condition in (
+        lambda f: f & ByteCode.ZERO_MARK,
+        lambda f: not f & ByteCode.ZERO_MARK,
+        lambda f: f & ByteCode.CARRY_MARK,
+        lambda f: f & (ByteCode.CARRY_MARK | ByteCode.ZERO_MARK),
+        lambda f: not f & (ByteCode.CARRY_MARK | ByteCode.ZERO_MARK),
+        lambda f: not f & ByteCode.CARRY_MARK,
+        lambda f: f & ByteCode.UNSIGNED_MARK,
+        lambda f: f & (ByteCode.UNSIGNED_MARK | ByteCode.ZERO_MARK),
+        lambda f: not f & (ByteCode.UNSIGNED_MARK | ByteCode.ZERO_MARK),
+        lambda f: not f & ByteCode.UNSIGNED_MARK,
+    )
+)
+
+_TYPE_BITS = {
+    ByteCode.BYTE_TYPE: 8,
+    ByteCode.SHORT_TYPE: 16,
+    ByteCode.INT_TYPE: 32,
+    ByteCode.LONG_TYPE: 64
+}
+
+
+def _sign_extend(value: int, bits: int) -> int:
+    value &= (1 << bits) - 1
+    return value - (1 << bits) if value >> (bits - 1) else value
+
+
+def _to_double(bits: int) -> float:
+    return struct.unpack('<d', struct.pack('<Q', bits & _MASK64))[0]
+
+
+def _from_double(value: float) -> int:
+    return struct.unpack('<q', struct.pack('<d', value))[0]
+
+
+def _to_float(bits: int) -> float:
+    return struct.unpack('<f', struct.pack('<I', bits & 0xFFFFFFFF))[0]
+
+
+def _from_float(value: float) -> int:
+    try:
+        return struct.unpack('<i', struct.pack('<f', value))[0]
+    except OverflowError:
+        return struct.unpack('<i', struct.pack('<f', math.copysign(math.inf, value)))[0]
+
+
+def _double_to_long(value: float) -> int:
+    if math.isnan(value):
+        return 0
+    if math.isinf(value):
+        return (1 << 63) - 1 if value > 0 else -(1 << 63)
+    return max(-(1 << 63), min((1 << 63) - 1, int(value)))
+
+
+def _divide(value1: int, value2: int) -> int:
+    """向零取整的整数除法"""
+    if value2 == 0:
+        raise RuntimeError("Division by zero")
+    quotient = abs(value1) // abs(value2)
+    return -quotient if (value1 < 0) != (value2 < 0) else quotient
+
+
+def _modulo(value1: int, value2: int) -> int:
+    return value1 - value2 * _divide(value1, value2)
+
+
+def _divide_real(value1: float, value2: float) -> float:
+    if value2 == 0:
+        if value1 == 0 or math.isnan(value1):
+            return math.nan
+        return math.copysign(math.inf, value1) * math.copysign(1, value2)
+    return value1 / value2
+
+
+def _modulo_real(value1: float, value2: float) -> float:
+    if value2 == 0 or math.isinf(value1):
+        return math.nan
+    return math.fmod(value1, value2)
+
+
+_INTEGER_OPERATIONS = {
+    ByteCode.ADD: lambda a, b: a + b,
+    ByteCode.SUB: lambda a, b: a - b,
+    ByteCode.MUL: lambda a, b: a * b,
+    ByteCode.DIV: _divide,
+    ByteCode.MOD: _modulo,
+    ByteCode.AND: lambda a, b: a & b,
+    ByteCode.OR: lambda a, b: a | b,
+    ByteCode.XOR: lambda a, b: a ^ b,
+    ByteCode.SHL: lambda a, b: a << (b & 63),
+    ByteCode.SHR: lambda a, b: a >> (b & 63),
+    ByteCode.USHR: lambda a, b: (a & _MASK64) >> (b & 63)
+}
+
+_UNARY_OPERATIONS = {
+    ByteCode.NOT: lambda a: ~a,
+    ByteCode.NEG: lambda a: -a,
+    ByteCode.INC: lambda a: a + 1,
+    ByteCode.DEC: lambda a: a - 1
+}
+
+_REAL_OPERATIONS = {
+    0: lambda a, b: a + b,
+    1: lambda a, b: a - b,
+    2: lambda a, b: a * b,
+    3: _divide_real,
+    4: _modulo_real
+}
+
+
+def _compare(eu: ExecutionUnit, type_: int, value1: int, value2: int):
+    if type_ == ByteCode.BYTE_TYPE:
+        value1 &= 0xFF
+        value2 &= 0xFF
+    elif type_ == ByteCode.SHORT_TYPE:
+        value1 &= 0xFFFF
+        value2 &= 0xFFFF
+    elif type_ == ByteCode.INT_TYPE:
+        value1 &= 0xFFFFFFFF
+        value2 &= 0xFFFFFFFF
+
+    flags = eu.flags & ~_FLAG_MASK
+    if value1 == value2:
+        eu.flags = flags | ByteCode.ZERO_MARK
+    else:
+        carry = ByteCode.CARRY_MARK if value1 < value2 else 0
+        unsigned = ByteCode.UNSIGNED_MARK if (value1 & _MASK64) < (value2 & _MASK64) else 0
+        eu.flags = flags | carry | unsigned
+
+
+def _handle_nop(eu, registers, memory, operands):
+    pass
+
+
+# 栈操作
+def _handle_push_1(eu, registers, memory, operands):
+    sp = registers[_SP] - 1
+    registers[_SP] = sp
+    memory.set_byte(sp, registers[operands[0]])
+
+
+def _handle_push_2(eu, registers, memory, operands):
+    sp = registers[_SP] - 2
+    registers[_SP] = sp
+    memory.set_short(sp, registers[operands[0]])
+
+
+def _handle_push_4(eu, registers, memory, operands):
+    sp = registers[_SP] - 4
+    registers[_SP] = sp
+    memory.set_int(sp, registers[operands[0]])
+
+
+def _handle_push_8(eu, registers, memory, operands):
+    sp = registers[_SP] - 8
+    registers[_SP] = sp
+    memory.set_long(sp, registers[operands[0]])
+
+
+def _handle_pop_1(eu, registers, memory, operands):
+    sp = registers[_SP]
+    registers[_SP] = sp + 1
+    registers[operands[0]] = memory.get_byte(sp)
+
+
+def _handle_pop_2(eu, registers, memory, operands):
+    sp = registers[_SP]
+    registers[_SP] = sp + 2
+    registers[operands[0]] = memory.get_short(sp)
+
+
+def _handle_pop_4(eu, registers, memory, operands):
+    sp = registers[_SP]
+    registers[_SP] = sp + 4
+    registers[operands[0]] = memory.get_int(sp)
+
+
+def _handle_pop_8(eu, registers, memory, operands):
+    sp = registers[_SP]
+    registers[_SP] = sp + 8
+    registers[operands[0]] = memory.get_long(sp)
+
+
+# 内存读写
+def _handle_load_1(eu, registers, memory, operands):
+    registers[operands[1]] = memory.get_byte(registers[operands[0]])
+
+
+def _handle_load_2(eu, registers, memory, operands):
+    registers[operands[1]] = memory.get_short(registers[operands[0]])
+
+
+def _handle_load_4(eu, registers, memory, operands):
+    registers[operands[1]] = memory.get_int(registers[operands[0]])
+
+
+def _handle_load_8(eu, registers, memory, operands):
+    registers[operands[1]] = memory.get_long(registers[operands[0]])
+
+
+def _handle_store_1(eu, registers, memory, operands):
+    memory.set_byte(registers[operands[0]], registers[operands[1]])
+
+
+def _handle_store_2(eu, registers, memory, operands):
+    memory.set_short(registers[operands[0]], registers[operands[1]])
+
+
+def _handle_store_4(eu, registers, memory, operands):
+    memory.set_int(registers[operands[0]], registers[operands[1]])
+
+
+def _handle_store_8(eu, registers, memory, operands):
+    memory.set_long(registers[operands[0]], registers[operands[1]])
+
+
+# 比较
+def _handle_cmp(eu, registers, memory, operands):
+    type_, operand1, operand2 = operands
+    _compare(eu, type_, registers[operand1], registers[operand2])
+
+
+_LOADERS = {
+    ByteCode.BYTE_TYPE: "get_byte",
+    ByteCode.SHORT_TYPE: "get_short",
+    ByteCode.INT_TYPE: "get_int",
+    ByteCode.LONG_TYPE: "get_long"
+}
+
+
+def _handle_atomic_cmp(eu, registers, memory, operands):
+    type_, address_reg, value_reg = operands
+    with memory.lock:
+        value = getattr(memory, _LOADERS[type_])(registers[address_reg])
+    _compare(eu, type_, value, registers[value_reg])
+
+
+# 移动
+def _conditional_move_handler(condition: tuple[bool, ...]):
+    def handler(eu, registers, memory, operands):
+        if condition[eu.flags & _FLAG_MASK]:
+            registers[operands[1]] = registers[operands[0]]
+
+    return handler
+
+
+def _handle_mov(eu, registers, memory, operands):
+    registers[operands[1]] = registers[operands[0]]
+
+
+def _handle_mov_immediate(eu, registers, memory, operands):
+    registers[operands[1]] = operands[0]
+
+
+# 跳转
+def _handle_jump(eu, registers, memory, operands):
+    registers[_PC] = registers[operands[0]]
+
+
+def _handle_jump_immediate(eu, registers, memory, operands):
+    registers[_PC] = operands[0]
+
+
+def _conditional_jump_handler(condition: tuple[bool, ...]):
+    def handler(eu, registers, memory, operands):
+        if condition[eu.flags & _FLAG_MASK]:
+            registers[_PC] = registers[operands[0]]
+
+    return handler
+
+
+# 内存分配
+def _handle_malloc(eu, registers, memory, operands):
+    registers[operands[1]] = eu.heap.allocate(registers[operands[0]])
+
+
+def _handle_free(eu, registers, memory, operands):
+    eu.heap.free(registers[operands[0]])
+
+
+def _handle_realloc(eu, registers, memory, operands):
+    address_reg, size_reg, result_reg = operands
+    registers[result_reg] = eu.heap.reallocate(registers[address_reg], registers[size_reg])
+
+
+# 区域分配
+def _handle_region_create(eu, registers, memory, operands):
+    registers[operands[0]] = memory.create_region()
+
+
+def _handle_region_alloc(eu, registers, memory, operands):
+    region_reg, size_reg, result_reg = operands
+    registers[result_reg] = memory.region_allocate(registers[region_reg], registers[size_reg])
+
+
+def _handle_region_destroy(eu, registers, memory, operands):
+    memory.destroy_region(registers[operands[0]])
+
+
+# 整数运算
+def _handle_add(eu, registers, memory, operands):
+    registers[operands[2]] = registers[operands[0]] + registers[operands[1]]
+
+
+def _handle_sub(eu, registers, memory, operands):
+    registers[operands[2]] = registers[operands[0]] - registers[operands[1]]
+
+
+def _handle_mul(eu, registers, memory, operands):
+    registers[operands[2]] = registers[operands[0]] * registers[operands[1]]
+
+
+def _handle_and(eu, registers, memory, operands):
+    registers[operands[2]] = registers[operands[0]] & registers[operands[1]]
+
+
+def _handle_or(eu, registers, memory, operands):
+    registers[operands[2]] = registers[operands[0]] | registers[operands[1]]
+
+
+def _handle_xor(eu, registers, memory, operands):
+    registers[operands[2]] = registers[operands[0]] ^ registers[operands[1]]
+
+
+def _handle_inc(eu, registers, memory, operands):
+    registers[operands[0]] += 1
+
+
+def _handle_dec(eu, registers, memory, operands):
+    registers[operands[0]] -= 1
+
+
+def _binary_handler(operation):
+    def handler(eu, registers, memory, operands):
+        registers[operands[2]] = operation(registers[operands[0]], registers[operands[1]])
+
+    return handler
+
+
+def _unary_handler(operation):
+    def handler(eu, registers, memory, operands):
+        registers[operands[1]] = operation(registers[operands[0]])
+
+    return handler
+
+
+# 浮点运算 (寄存器保存IEEE 754位模式)
+def _double_handler(operation):
+    def handler(eu, registers, memory, operands):
+        registers[operands[2]] = _from_double(
+            operation(_to_double(registers[operands[0]]), _to_double(registers[operands[1]])))
+
+    return handler
+
+
+def _float_handler(operation):
+    def handler(eu, registers, memory, operands):
+        registers[operands[2]] = _from_float(
+            operation(_to_float(registers[operands[0]]), _to_float(registers[operands[1]])))
+
+    return handler
+
+
+# 原子运算: 第一个操作数为地址寄存器, 对内存中的值做读-改-写并把新值写入结果寄存器
+def _atomic_binary_handler(operation):
+    def handler(eu, registers, memory, operands):
+        address_reg, value_reg, result_reg = operands
+        address = registers[address_reg]
+        with memory.lock:
+            value = operation(memory.get_long(address), registers[value_reg])
+            memory.set_long(address, value)
+        registers[result_reg] = value
+
+    return handler
+
+
+def _atomic_unary_handler(operation):
+    def handler(eu, registers, memory, operands):
+        address = registers[operands[0]]
+        with memory.lock:
+            value = operation(memory.get_long(address))
+            memory.set_long(address, value)
+        if len(operands) > 1:
+            registers[operands[1]] = value
+
+    return handler
+
+
+def _atomic_double_handler(operation):
+    def handler(eu, registers, memory, operands):
+        address_reg, value_reg, result_reg = operands
+        address = registers[address_reg]
+        with memory.lock:
+            value = _from_double(operation(_to_double(memory.get_long(address)), _to_double(registers[value_reg])))
+            memory.set_long(address, value)
+        registers[result_reg] = value
+
+    return handler
+
+
+def _atomic_float_handler(operation):
+    def handler(eu, registers, memory, operands):
+        address_reg, value_reg, result_reg = operands
+        address = registers[address_reg]
+        with memory.lock:
+            value = _from_float(operation(_to_float(memory.get_int(address)), _to_float(registers[value_reg])))
+            memory.set_int(address, value)
+        registers[result_reg] = value
+
+    return handler
+
+
+def _handle_cas(eu, registers, memory, operands):
+    address_reg, expected_reg, value_reg = operands
+    address = registers[address_reg]
+    with memory.lock:
+        current = memory.get_long(address)
+        if current & _MASK64 == registers[expected_reg] & _MASK64:
+            memory.set_long(address, registers[value_reg])
+            eu.flags |= ByteCode.ZERO_MARK
+        else:
+            registers[expected_reg] = current
+            eu.flags &= ~ByteCode.ZERO_MARK
+
+
+# 函数调用
+def _handle_invoke(eu, registers, memory, operands):
+    sp = registers[_SP] - 8
+    memory.set_long(sp, registers[_PC])
+    registers[_SP] = sp
+    registers[_PC] = registers[operands[0]]
+
+
+def _handle_invoke_immediate(eu, registers, memory, operands):
+    sp = registers[_SP] - 8
+    memory.set_long(sp, registers[_PC])
+    registers[_SP] = sp
+    registers[_PC] = operands[0]
+
+
+def _handle_return(eu, registers, memory, operands):
+    sp = registers[_SP]
+    registers[_PC] = memory.get_long(sp)
+    registers[_SP] = sp + 8
+
+
+def _handle_get_result(eu, registers, memory, operands):
+    registers[operands[0]] = eu.result
+
+
+def _handle_set_result(eu, registers, memory, operands):
+    eu.result = registers[operands[0]]
+
+
+# 类型转换
+def _handle_type_cast(eu, registers, memory, operands):
+    types, source, target = operands
+    value = _sign_extend(registers[source], _TYPE_BITS[types >> 4])
+    registers[target] = _sign_extend(value, _TYPE_BITS[types & 0xF])
+
+
+def _handle_long_to_double(eu, registers, memory, operands):
+    registers[operands[1]] = _from_double(float(registers[operands[0]]))
+
+
+def _handle_double_to_long(eu, registers, memory, operands):
+    registers[operands[1]] = _double_to_long(_to_double(registers[operands[0]]))
+
+
+def _handle_double_to_float(eu, registers, memory, operands):
+    registers[operands[1]] = _from_float(_to_double(registers[operands[0]]))
+
+
+def _handle_float_to_double(eu, registers, memory, operands):
+    registers[operands[1]] = _from_double(_to_float(registers[operands[0]]))
+
+
+# 系统调用
+def _handle_open(eu, registers, memory, operands):
+    path_reg, flags_reg, mode_reg, result_reg = operands
+    path = memory.read_string(registers[path_reg])
+    try:
+        registers[result_reg] = eu.virtual_machine.open(
+            path.decode('utf-8'),
+            registers[flags_reg],
+            registers[mode_reg]
+        )
+    except FileNotFoundError:
+        registers[result_reg] = -1
+
+
+def _handle_close(eu, registers, memory, operands):
+    registers[operands[1]] = eu.virtual_machine.close(registers[operands[0]])
+
+
+def _handle_read(eu, registers, memory, operands):
+    fd_reg, buffer_reg, count_reg, result_reg = operands
+    address = registers[buffer_reg]
+    buffer = bytearray(registers[count_reg])
+    count = eu.virtual_machine.read(registers[fd_reg], buffer, len(buffer))
+    memory.write_bytes(address, memoryview(buffer)[:count])
+    registers[result_reg] = count
+
+
+def _handle_write(eu, registers, memory, operands):
+    fd_reg, buffer_reg, count_reg, result_reg = operands
+    address = registers[buffer_reg]
+    buffer = memory.read_bytes(address, registers[count_reg])
+    registers[result_reg] = eu.virtual_machine.write(registers[fd_reg], buffer)
+
+
+# 块内存操作
+def _handle_memcpy(eu, registers, memory, operands):
+    destination_reg, source_reg, length_reg = operands
+    memory.copy_within(registers[destination_reg], registers[source_reg], registers[length_reg])
+
+
+def _handle_memset(eu, registers, memory, operands):
+    destination_reg, value_reg, length_reg = operands
+    memory.fill(registers[destination_reg], registers[value_reg], registers[length_reg])
+
+
+def _handle_memcmp(eu, registers, memory, operands):
+    first_reg, second_reg, length_reg, result_reg = operands
+    registers[result_reg] = memory.compare(registers[first_reg], registers[second_reg], registers[length_reg])
+
+
+def _handle_strlen(eu, registers, memory, operands):
+    address_reg, result_reg = operands
+    address = registers[address_reg]
+    registers[result_reg] = memory.find_byte(address, 0) - address
+
+
+# 栈帧
+def _handle_create_frame(eu, registers, memory, operands):
+    sp = registers[_SP] - 8
+    memory.set_long(sp, registers[_BP])
+    registers[_BP] = sp
+    registers[_SP] = sp - operands[0]
+
+
+def _handle_destroy_frame(eu, registers, memory, operands):
+    sp = registers[_SP] + operands[0]
+    registers[_BP] = memory.get_long(sp)
+    registers[_SP] = sp + 8
+
+
+def _handle_get_field_address(eu, registers, memory, operands):
+    object_reg, offset, target = operands
+    registers[target] = registers[object_reg] + offset
+
+
+def _handle_get_local_address(eu, registers, memory, operands):
+    registers[operands[1]] = registers[_BP] - operands[0]
+
+
+def _handle_get_parameter_address(eu, registers, memory, operands):
+    # 跳过保存的BP与返回地址
+    registers[operands[1]] = registers[_BP] + 16 + operands[0]
+
+
+# 退出
+def _handle_exit(eu, registers, memory, operands):
+    eu.virtual_machine.exit(registers[operands[0]])
+    eu.running = False
+
+
+def _handle_exit_immediate(eu, registers, memory, operands):
+    eu.virtual_machine.exit(operands[0])
+    eu.running = False
+
+
+# 线程
+def _handle_create_thread(eu, registers, memory, operands):
+    entry_point, result_reg = operands
+    registers[result_reg] = eu.virtual_machine.create_thread(entry_point)
+
+
+def _handle_thread_control(eu, registers, memory, operands):
+    thread_reg, command, register, value_reg = operands
+    handle = eu.virtual_machine.thread_id_to_handle.get(registers[thread_reg])
+    if handle is None:
+        raise RuntimeError(f"Invalid thread id: {registers[thread_reg]}")
+
+    target = handle.execution_unit
+    if command == ByteCode.TC_STOP:
+        target.running = False
+    elif command == ByteCode.TC_WAIT:
+        handle.thread.join()
+    elif command == ByteCode.TC_GET_REGISTER:
+        registers[value_reg] = target.registers[register]
+    elif command == ByteCode.TC_SET_REGISTER:
+        target.registers[register] = registers[value_reg]
+    else:
+        raise RuntimeError(f"Unknown thread control command: {command}")
+
+
+# 超级指令
+def _handle_cmp_jump(eu, registers, memory, operands):
+    type_, operand1, operand2, condition, address_reg = operands
+    _compare(eu, type_, registers[operand1], registers[operand2])
+    if _CONDITIONS[condition][eu.flags & _FLAG_MASK]:
+        registers[_PC] = registers[address_reg]
+
+
+def _handle_mov_immediate_add(eu, registers, memory, operands):
+    value, target, operand1, operand2, result_reg = operands
+    registers[target] = value
+    registers[result_reg] = registers[operand1] + registers[operand2]
+
+
+def _handle_mov_immediate_sub(eu, registers, memory, operands):
+    value, target, operand1, operand2, result_reg = operands
+    registers[target] = value
+    registers[result_reg] = registers[operand1] - registers[operand2]
+
+
+_STACK_HANDLERS = {
+    ByteCode.PUSH_1: _handle_push_1,
+    ByteCode.PUSH_2: _handle_push_2,
+    ByteCode.PUSH_4: _handle_push_4,
+    ByteCode.PUSH_8: _handle_push_8,
+    ByteCode.POP_1: _handle_pop_1,
+    ByteCode.POP_2: _handle_pop_2,
+    ByteCode.POP_4: _handle_pop_4,
+    ByteCode.POP_8: _handle_pop_8
+}
+
+
+def _handle_stack_run(eu, registers, memory, operands):
+    for code, stack_operands in operands:
+        _STACK_HANDLERS[code](eu, registers, memory, stack_operands)
+
+
+def _handle_unknown(eu, registers, memory, operands):
+    pc = registers[_PC] - 1
+    print(f"Unknown instruction code: {memory.get_byte(pc)} at PC={pc}")
+    eu.running = False
+
+
+def _build_dispatch_table() -> list:
+    handlers = {
+        ByteCode.NOP: _handle_nop,
+        ByteCode.PUSH_1: _handle_push_1,
+        ByteCode.PUSH_2: _handle_push_2,
+        ByteCode.PUSH_4: _handle_push_4,
+        ByteCode.PUSH_8: _handle_push_8,
+        ByteCode.POP_1: _handle_pop_1,
+        ByteCode.POP_2: _handle_pop_2,
+        ByteCode.POP_4: _handle_pop_4,
+        ByteCode.POP_8: _handle_pop_8,
+        ByteCode.LOAD_1: _handle_load_1,
+        ByteCode.LOAD_2: _handle_load_2,
+        ByteCode.LOAD_4: _handle_load_4,
+        ByteCode.LOAD_8: _handle_load_8,
+        ByteCode.STORE_1: _handle_store_1,
+        ByteCode.STORE_2: _handle_store_2,
+        ByteCode.STORE_4: _handle_store_4,
+        ByteCode.STORE_8: _handle_store_8,
+        ByteCode.CMP: _handle_cmp,
+        ByteCode.ATOMIC_CMP: _handle_atomic_cmp,
+        ByteCode.MOV: _handle_mov,
+        ByteCode.MOV_IMMEDIATE1: _handle_mov_immediate,
+        ByteCode.MOV_IMMEDIATE2: _handle_mov_immediate,
+        ByteCode.MOV_IMMEDIATE4: _handle_mov_immediate,
+        ByteCode.MOV_IMMEDIATE8: _handle_mov_immediate,
+        ByteCode.JUMP: _handle_jump,
+        ByteCode.JUMP_IMMEDIATE: _handle_jump_immediate,
+        ByteCode.MALLOC: _handle_malloc,
+        ByteCode.FREE: _handle_free,
+        ByteCode.REALLOC: _handle_realloc,
+        ByteCode.ADD: _handle_add,
+        ByteCode.SUB: _handle_sub,
+        ByteCode.MUL: _handle_mul,
+        ByteCode.AND: _handle_and,
+        ByteCode.OR: _handle_or,
+        ByteCode.XOR: _handle_xor,
+        ByteCode.INC: _handle_inc,
+        ByteCode.DEC: _handle_dec,
+        ByteCode.CAS: _handle_cas,
+        ByteCode.INVOKE: _handle_invoke,
+        ByteCode.INVOKE_IMMEDIATE: _handle_invoke_immediate,
+        ByteCode.RETURN: _handle_return,
+        ByteCode.GET_RESULT: _handle_get_result,
+        ByteCode.SET_RESULT: _handle_set_result,
+        ByteCode.TYPE_CAST: _handle_type_cast,
+        ByteCode.LONG_TO_DOUBLE: _handle_long_to_double,
+        ByteCode.DOUBLE_TO_LONG: _handle_double_to_long,
+        ByteCode.DOUBLE_TO_FLOAT: _handle_double_to_float,
+        ByteCode.FLOAT_TO_DOUBLE: _handle_float_to_double,
+        ByteCode.OPEN: _handle_open,
+        ByteCode.CLOSE: _handle_close,
+        ByteCode.READ: _handle_read,
+        ByteCode.WRITE: _handle_write,
+        ByteCode.CREATE_FRAME: _handle_create_frame,
+        ByteCode.DESTROY_FRAME: _handle_destroy_frame,
+        ByteCode.EXIT: _handle_exit,
+        ByteCode.EXIT_IMMEDIATE: _handle_exit_immediate,
+        ByteCode.GET_FIELD_ADDRESS: _handle_get_field_address,
+        ByteCode.GET_LOCAL_ADDRESS: _handle_get_local_address,
+        ByteCode.GET_PARAMETER_ADDRESS: _handle_get_parameter_address,
+        ByteCode.CREATE_THREAD: _handle_create_thread,
+        ByteCode.THREAD_CONTROL: _handle_thread_control,
+        ByteCode.MEMCPY: _handle_memcpy,
+        ByteCode.MEMSET: _handle_memset,
+        ByteCode.MEMCMP: _handle_memcmp,
+        ByteCode.STRLEN: _handle_strlen,
+        ByteCode.REGION_CREATE: _handle_region_create,
+        ByteCode.REGION_ALLOC: _handle_region_alloc,
+        ByteCode.REGION_DESTROY: _handle_region_destroy
+    }
+
+    # 按指令族生成的处理函数
+    for i, condition in enumerate(_CONDITIONS):
+        handlers[ByteCode.MOV_E + i] = _conditional_move_handler(condition)
+        handlers[ByteCode.JE + i] = _conditional_jump_handler(condition)
+    for code, operation in _INTEGER_OPERATIONS.items():
+        handlers.setdefault(code, _binary_handler(operation))
+        handlers[code - ByteCode.ADD + ByteCode.ATOMIC_ADD] = _atomic_binary_handler(operation)
+    for code, operation in _UNARY_OPERATIONS.items():
+        if code in (ByteCode.NOT, ByteCode.NEG):
+            handlers[code] = _unary_handler(operation)
+        handlers[code - ByteCode.ADD + ByteCode.ATOMIC_ADD] = _atomic_unary_handler(operation)
+    for i, operation in _REAL_OPERATIONS.items():
+        handlers[ByteCode.ADD_DOUBLE + i] = _double_handler(operation)
+        handlers[ByteCode.ADD_FLOAT + i] = _float_handler(operation)
+        handlers[ByteCode.ATOMIC_ADD_DOUBLE + i] = _atomic_double_handler(operation)
+        handlers[ByteCode.ATOMIC_ADD_FLOAT + i] = _atomic_float_handler(operation)
+
+    missing = [name for code, name in ByteCode.instruction_names.items() if code not in handlers]
+    if missing:
+        raise RuntimeError(f"Missing handlers for instructions: {', '.join(missing)}")
+
+    table = [_handle_unknown] * 256
+    for code in ByteCode.instruction_names:
+        table[code] = handlers[code]
+
+    # 超级指令紧接在256项之后
+    table.extend([
+        _handle_cmp_jump,
+        _handle_mov_immediate_add,
+        _handle_mov_immediate_sub,
+        _handle_stack_run,
+        _handle_stack_run
+    ])
+    assert len(table) == SuperInstruction.POP_RUN + 1
+    return table
+
+
+DISPATCH_TABLE = _build_dispatch_table()
@@ -48,42 +48,38 @@ class OptionsParser:
         i = 0
         while i < len(args):
             arg = args[i]
+            value = None
+            if arg.startswith("-") and "=" in arg:
+                arg, value = arg.split("=", 1)
             if arg not in self.flags2Name:
-                others.append(arg)
+                others.append(args[i])
+                i += 1
                 continue
             name = self.flags2Name[arg]
             typ = self.name2Type[name]
             if typ == bool:
-                if i + 1 < len(args):
-                    next_ = args[i + 1]
-                    if next_ in ["true", "false"]:
-                        options[name] = next_ == "true"
-                        i += 1
-                        break
-                options[name] = True
-            elif typ == str:
-                if i + 1 < len(args):
-                    options[name] = args[i + 1]
+                if value is not None:
+                    options[name] = value == "true"
+                elif i + 1 < len(args) and args[i + 1] in ["true", "false"]:
+                    options[name] = args[i + 1] == "true"
                     i += 1
                 else:
-                    raise ValueError(f"Missing argument for {name}")
-            elif typ == int:
-                if i + 1 < len(args):
-                    options[name] = int(args[i + 1])
-                    i += 1
-                else:
-                    raise ValueError(f"Missing argument for {name}")
-            elif float:
-                if i + 1 < len(args):
-                    options[name] = float(args[i + 1])
+                    options[name] = True
+            else:
+                if value is None:
+                    if i + 1 >= len(args):
+                        raise ValueError(f"Missing argument for {name}")
+                    value = args[i + 1]
                     i += 1
+                options[name] = typ(value)
+            i += 1
             if self.skip:
                 break
 
-        for i in range(i, len(args)):
-            others.append(args[i])
+        for j in range(i, len(args)):
+            others.append(args[j])
 
-        for name, value in self.defaults:
+        for name, value in self.defaults.items():
             if name not in options:
                 options[name] = value
         return Options(options, others, self.helps)